@@ -0,0 +1,68 @@
+"""
+Check that importing ruska stays cheap: fails if `import ruska` or
+`from ruska import Ruska` take longer than their budget in a fresh
+interpreter, or if they load one of the heavy dependencies that only the
+inspector, corruptor and plotter need.
+
+    python benchmarks/import_time.py --budget 0.1
+"""
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+HEAVY_MODULES = ["pandas", "matplotlib", "sklearn", "jenga", "requests", "scipy"]
+
+STATEMENTS = ["import ruska", "from ruska import Ruska"]
+
+# The probes run in the checkout, so they import it without installing ruska.
+ROOT = Path(__file__).resolve().parents[1]
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(statement: str, repeat: int) -> dict:
+    """Best import time out of repeat fresh interpreters, and the modules it loaded."""
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(statement=statement)],
+            check=True,
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout
+        probe = json.loads(output)
+        if best is None or probe["seconds"] < best["seconds"]:
+            best = probe
+    heavy = [m for m in HEAVY_MODULES if m in best["modules"]]
+    return {"statement": statement, "seconds": best["seconds"], "heavy_modules": heavy}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=float, default=0.1, help="seconds per statement")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for statement in STATEMENTS:
+        m = measure(statement, args.repeat)
+        ok = m["seconds"] <= args.budget and len(m["heavy_modules"]) == 0
+        failed |= not ok
+        print(
+            f"{'ok  ' if ok else 'FAIL'} {statement!r}: {m['seconds'] * 1000:.1f} ms "
+            f"(budget {args.budget * 1000:.0f} ms), heavy modules: {m['heavy_modules']}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
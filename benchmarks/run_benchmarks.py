@@ -0,0 +1,297 @@
+"""
+Benchmarks of ruska's hot paths on synthetic data. Records the best time
+out of --repeat calls and the peak memory allocated during one call, per
+benchmark and scale, to a JSON file, and compares them against a baseline
+written earlier on the same machine:
+
+    python benchmarks/run_benchmarks.py --scales 1k,100k --output bench.json
+    python benchmarks/run_benchmarks.py --update-baseline
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+
+Exits with 1 if a benchmark got slower than the baseline by more than
+--tolerance. Everything runs offline. Peak memory is measured with
+tracemalloc and only covers the benchmarking process, not pool workers.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Union
+
+import numpy as np
+import pandas as pd
+
+# Run from a checkout without installing ruska.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ruska import Ruska, Inspector, Corruptor, RunAggregator
+from ruska.helpers import simple_mcar, reduce_runs, reduce_runs_list
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+N_COLUMNS = 10
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+# name -> setup(n_rows, workdir), which returns the function to time
+BENCHMARKS: Dict[str, Callable[[int, Path], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def make_frame(n_rows: int, n_columns: int = N_COLUMNS, seed: int = 0) -> pd.DataFrame:
+    """Categorical string data, like the datasets we clean."""
+    rng = np.random.default_rng(seed)
+    data = {
+        f"col_{j}": rng.integers(0, 50, n_rows).astype(str).astype(object)
+        for j in range(n_columns)
+    }
+    return pd.DataFrame(data)
+
+
+def make_results(n_results: int, vector_length: Union[None, int] = None, seed: int = 0) -> list:
+    """Results as experiments return them, five runs per configuration."""
+    rng = random.Random(seed)
+    results = []
+    for i in range(n_results):
+        config = {
+            "dataset": f"dataset_{i // 50}",
+            "error_fraction": str((i // 5) % 10 / 10),
+            "run": i % 5,
+        }
+        if vector_length is None:
+            metrics = {m: rng.random() for m in ["f1", "precision", "recall"]}
+        else:
+            metrics = {
+                m: [rng.random() for _ in range(vector_length)]
+                for m in ["f1", "precision", "recall"]
+            }
+        results.append({"config": config, "result": metrics})
+    return results
+
+
+def _noop_experiment(i: int, config: dict):
+    return {"config": config, "result": {"f1": 0.5, "precision": 0.5, "recall": 0.5}}
+
+
+def _ruska(n_configs: int, workdir: Path, name: str) -> Ruska:
+    return Ruska(
+        name=name,
+        description="benchmark",
+        commit="",
+        config={"dataset": "", "error_fraction": 0.0, "run": 0},
+        ranges={
+            "dataset": [f"dataset_{k}" for k in range(max(1, n_configs // 50))],
+            "error_fraction": [k / 10 for k in range(10)],
+        },
+        runs=5,
+        save_path=str(workdir),
+    )
+
+
+@benchmark("simple_mcar")
+def _(n_rows, workdir):
+    df = make_frame(n_rows)
+    return lambda: simple_mcar(df, 0.1, rng=np.random.default_rng(0))
+
+
+@benchmark("corruptor_run")
+def _(n_rows, workdir):
+    try:
+        import jenga  # noqa: F401
+    except ImportError:
+        return None
+    make_frame(n_rows).to_csv(workdir / "corrupt.csv", index=False)
+    corruptor = Corruptor(str(workdir / "corrupt"))
+    corruptor.fractions = [0.1, 0.5]
+    return corruptor.run
+
+
+@benchmark("corruptor_run_vectorised")
+def _(n_rows, workdir):
+    make_frame(n_rows).to_csv(workdir / "corrupt_vectorised.csv", index=False)
+    corruptor = Corruptor(str(workdir / "corrupt_vectorised"), seed=0)
+    corruptor.fractions = [0.1, 0.5]
+    return lambda: corruptor.run_vectorised(workers=1)
+
+
+@benchmark("reduce_runs")
+def _(n_rows, workdir):
+    results = [{**r["config"], **r["result"]} for r in make_results(n_rows // 10)]
+    return lambda: reduce_runs(results)
+
+
+@benchmark("run_aggregator")
+def _(n_rows, workdir):
+    results = [{**r["config"], **r["result"]} for r in make_results(n_rows // 10)]
+
+    def aggregate():
+        aggregator = RunAggregator()
+        for r in results:
+            aggregator.add(r)
+        return aggregator.result()
+
+    return aggregate
+
+
+@benchmark("reduce_runs_list")
+def _(n_rows, workdir):
+    results = make_results(max(10, n_rows // 100), vector_length=100)
+    return lambda: reduce_runs_list(results)
+
+
+@benchmark("load_result")
+def _(n_rows, workdir):
+    rsk = _ruska(n_rows // 100, workdir, "load_result")
+    with contextlib.redirect_stdout(io.StringIO()):
+        rsk.run(_noop_experiment)
+    return lambda: Ruska.load_result(rsk.save_path)
+
+
+@benchmark("cleaning_performance")
+def _(n_rows, workdir):
+    df_clean = make_frame(n_rows, 1)
+    y_clean = df_clean.iloc[:, 0]
+    y_dirty = simple_mcar(df_clean, 0.1, "x", rng=np.random.default_rng(1)).iloc[:, 0]
+    y_pred = simple_mcar(df_clean, 0.05, "x", rng=np.random.default_rng(2)).iloc[:, 0]
+    inspector = Inspector(assume_errors_known=False)
+
+    def evaluate():
+        with contextlib.redirect_stdout(io.StringIO()):
+            inspector.calculate_error_positions(y_clean, y_dirty)
+            return inspector.cleaning_performance(y_clean, y_pred, y_dirty)
+
+    return evaluate
+
+
+@benchmark("cleaning_performance_frame")
+def _(n_rows, workdir):
+    df_clean = make_frame(n_rows)
+    df_dirty = simple_mcar(df_clean, 0.1, "x", rng=np.random.default_rng(1))
+    df_pred = simple_mcar(df_clean, 0.05, "x", rng=np.random.default_rng(2))
+    inspector = Inspector(assume_errors_known=False)
+    return lambda: inspector.cleaning_performance_frame(df_clean, df_pred, df_dirty)
+
+
+def _run_overhead(n_rows, workdir, parallel):
+    # per-task overhead of Ruska.run, with an experiment that does nothing
+    rsk = _ruska(min(n_rows // 100, 1_000), workdir, f"overhead_{parallel}")
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            rsk.run(_noop_experiment, parallel=parallel, workers=2, chunksize=16)
+
+    return run
+
+
+@benchmark("ruska_run_sequential")
+def _(n_rows, workdir):
+    return _run_overhead(n_rows, workdir, parallel=False)
+
+
+@benchmark("ruska_run_parallel")
+def _(n_rows, workdir):
+    return _run_overhead(n_rows, workdir, parallel=True)
+
+
+def measure(function: Callable, repeat: int) -> dict:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print the change against baseline. Returns False on a regression."""
+    ok = True
+    for key, m in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:45s} {m['seconds']:9.4f}s  (not in baseline)")
+            continue
+        ratio = m["seconds"] / base["seconds"] if base["seconds"] > 0 else float("inf")
+        regressed = ratio > 1 + tolerance
+        ok &= not regressed
+        print(
+            f"{key:45s} {m['seconds']:9.4f}s  {ratio:5.2f}x baseline"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ruska's hot paths.")
+    parser.add_argument("--scales", default="1k,100k", help=f"any of {list(SCALES)}")
+    parser.add_argument("--only", default=None, help="comma-separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    names = list(BENCHMARKS) if args.only is None else args.only.split(",")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales.split(","):
+            for name in names:
+                workdir = Path(tmp) / f"{name}_{scale}"
+                workdir.mkdir()
+                function = BENCHMARKS[name](SCALES[scale], workdir)
+                if function is None:
+                    print(f"{name}[{scale}] skipped, a dependency is missing.")
+                    continue
+                key = f"{name}[{scale}]"
+                results[key] = measure(function, args.repeat)
+                print(
+                    f"{key:45s} {results[key]['seconds']:9.4f}s "
+                    f"{results[key]['peak_bytes'] / 2**20:9.1f} MiB"
+                )
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(DEFAULT_BASELINE, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline_path = args.baseline
+    if baseline_path is None and DEFAULT_BASELINE.exists() and not args.update_baseline:
+        baseline_path = DEFAULT_BASELINE
+    if baseline_path is None:
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"Compared to {baseline_path}:")
+    return 0 if compare(results, baseline, args.tolerance) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
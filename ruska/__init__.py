@@ -1,6 +1,79 @@
-from .ruska import *
-from .inspector import *
-from .corruptor import *
-from .plotter import *
+import importlib
 
 name = "ruska"
+
+# Public names and the submodules defining them. A submodule is only imported
+# when one of its names is first accessed, so that `import ruska` and pool
+# workers don't load pandas, matplotlib, scikit-learn or jenga before an
+# experiment needs them.
+_exports = {
+    "ruska": ["Ruska"],
+    "grid": ["ParameterGrid", "Constraint", "conditional_range"],
+    "executor": [
+        "ExperimentFailure",
+        "ExperimentTimeout",
+        "MemoryLimitExceeded",
+        "WorkerLost",
+        "run_parallel",
+        "run_sequential",
+    ],
+    "journal": ["Journal"],
+    "cache": ["ResultCache"],
+    "storage": ["ResultTable", "write_result_table"],
+    "scheduler": ["RuntimeHistory"],
+    "datasets": ["get_dataset", "load_datasets", "publish_datasets"],
+    "notifications": ["NotificationDispatcher"],
+    "helpers": [
+        "RunAggregator",
+        "estimate_time_to_finish",
+        "get_distinct_list",
+        "reduce_runs",
+        "reduce_runs_list",
+        "send_notification",
+        "simple_mcar",
+    ],
+    "inspector": [
+        "Inspector",
+        "GroundTruth",
+        "ErrorContext",
+        "confusion_scores",
+        "count_chunk",
+        "differences",
+        "read_blocks",
+    ],
+    "errorstore": ["NestedErrorStore", "apply_errors", "write_nested_errors"],
+    "corruptor": [
+        "Corruptor",
+        "EncodedFrame",
+        "categorical_shift",
+        "derangement",
+        "nested_row_order",
+        "sample_rows",
+    ],
+    "plotter": [
+        "ReducedResult",
+        "jenga_plot",
+        "jenga_plot_datasets",
+        "plot_bars",
+        "prepare_result_v1",
+        "render_figures",
+    ],
+}
+_modules = {attr: module for module, attrs in _exports.items() for attr in attrs}
+
+__all__ = sorted(_modules)
+
+
+def __getattr__(attr: str):
+    if attr in _exports:
+        return importlib.import_module(f".{attr}", __name__)
+    module = _modules.get(attr)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {attr!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), attr)
+    globals()[attr] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_modules, *_exports])
@@ -0,0 +1,151 @@
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from typing import Union
+
+
+class ResultCache:
+    """
+    A content-addressed store of experiment results on the local disk.
+
+    Results are keyed by a hash of the fully merged configuration, the commit
+    of the experiment code and an optional fingerprint of everything else that
+    influences the result, e.g. the version of a dataset. When a grid gets
+    extended by a dataset or a run, only the new cells need to be measured.
+
+    The cache is bounded to max_bytes of pickled results. When it grows
+    beyond that, the least recently used results are evicted.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 2**30):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, "
+                "commit_hash TEXT, "
+                "size INTEGER, "
+                "last_access REAL, "
+                "result BLOB)"
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_access "
+                "ON results (last_access)"
+            )
+            # The total size of all results, kept up to date by put, so that
+            # it doesn't take a scan of the table to check the budget.
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+            con.execute(
+                "INSERT OR IGNORE INTO meta "
+                "SELECT 'total_size', COALESCE(SUM(size), 0) FROM results"
+            )
+
+    def _connect(self):
+        # A connection per operation, because Pool callbacks are called from
+        # another thread than the measurement loop.
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def key(config: dict, commit: str, fingerprint: Union[None, str] = None) -> str:
+        content = json.dumps(
+            {"config": config, "commit": commit, "fingerprint": fingerprint},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str, default=None):
+        """
+        Return the result stored at key, or default if there is none.
+        """
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT result FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            con.execute(
+                "UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        return pickle.loads(row[0])
+
+    def put(self, key: str, commit: str, result) -> None:
+        """
+        Store a result and evict the least recently used results if the cache
+        outgrew max_bytes. Results that cannot be pickled are not cached.
+        """
+        try:
+            data = pickle.dumps(result)
+        except Exception as e:
+            logger = logging.getLogger(__name__)
+            logger.warning(f"Cannot cache result {key}: {e!r}")
+            return
+        with self._connect() as con:
+            # BEGIN IMMEDIATE, so that concurrent puts don't lose each
+            # other's updates of the total size.
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute(
+                "SELECT size FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            con.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, commit, len(data), time.time(), data),
+            )
+            total = self._add_size(con, len(data) - (0 if row is None else row[0]))
+            if total > self.max_bytes:
+                self._evict(con, total)
+
+    @staticmethod
+    def _add_size(con: sqlite3.Connection, delta: int) -> int:
+        con.execute(
+            "UPDATE meta SET value = value + ? WHERE key = 'total_size'", (delta,)
+        )
+        (total,) = con.execute(
+            "SELECT value FROM meta WHERE key = 'total_size'"
+        ).fetchone()
+        return total
+
+    def _evict(self, con: sqlite3.Connection, total: int) -> None:
+        evicted = []
+        freed = 0
+        for key, size in con.execute(
+            "SELECT key, size FROM results ORDER BY last_access ASC"
+        ):
+            if total - freed <= self.max_bytes:
+                break
+            evicted.append((key,))
+            freed += size
+        con.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self._add_size(con, -freed)
+
+    def invalidate(self, commit: Union[None, str] = None) -> int:
+        """
+        Remove all results measured with commit. Removes every result if
+        commit is None. Returns the number of removed results.
+        """
+        with self._connect() as con:
+            if commit is None:
+                cursor = con.execute("DELETE FROM results")
+            else:
+                cursor = con.execute(
+                    "DELETE FROM results WHERE commit_hash = ?", (commit,)
+                )
+            con.execute(
+                "UPDATE meta SET value = "
+                "(SELECT COALESCE(SUM(size), 0) FROM results) "
+                "WHERE key = 'total_size'"
+            )
+            return cursor.rowcount
+
+    def __len__(self):
+        with self._connect() as con:
+            (n,) = con.execute("SELECT COUNT(*) FROM results").fetchone()
+        return n
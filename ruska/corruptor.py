@@ -1,8 +1,145 @@
 import random
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from jenga.corruptions.generic import CategoricalShift
+from multiprocessing import Pool
+from typing import List, Tuple, Union
 from ruska.helpers import simple_mcar
+from ruska.errorstore import write_nested_errors
+
+
+class EncodedFrame:
+    """
+    A DataFrame factorised into integer codes per column, with the codes
+    sorted by value, so that corruptions can be computed on numpy arrays
+    instead of copying and transforming the whole DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.index = df.index
+        self.columns = list(df.columns)
+        self.codes: List[np.ndarray] = []
+        self.uniques: List[pd.Index] = []
+        self.orders: List[np.ndarray] = []
+        for column in self.columns:
+            codes, uniques = pd.factorize(df[column], sort=True)
+            self.codes.append(codes)
+            self.uniques.append(uniques)
+            # row positions ordered by the column's values
+            self.orders.append(np.argsort(codes, kind="stable"))
+
+    def __len__(self):
+        return len(self.index)
+
+    def decode(self, codes: List[np.ndarray]) -> pd.DataFrame:
+        data = {}
+        for column, column_codes, uniques in zip(self.columns, codes, self.uniques):
+            values = uniques.take(np.maximum(column_codes, 0)).to_numpy(dtype=object)
+            values[column_codes < 0] = np.nan
+            data[column] = values
+        return pd.DataFrame(data, index=self.index)
+
+
+def sample_rows(
+    frame: EncodedFrame, j: int, fraction: float, sampling: str, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Select row positions of column j to corrupt, following Jenga's samplers:
+    - MCAR picks rows uniformly at random.
+    - MAR picks a random window of rows ordered by another, random column.
+    - MNAR picks a random window of rows ordered by column j itself.
+    """
+    n_rows = len(frame)
+    n_errors = int(n_rows * min(fraction, 1.0))
+    if sampling == "MCAR":
+        return rng.choice(n_rows, size=n_errors, replace=False)
+    depends_on = _depends_on(frame, j, sampling, rng)
+    start = rng.integers(0, n_rows - n_errors + 1)
+    return frame.orders[depends_on][start : start + n_errors]
+
+
+def _depends_on(
+    frame: EncodedFrame, j: int, sampling: str, rng: np.random.Generator
+) -> int:
+    """The column whose values decide which rows of column j get corrupted."""
+    if sampling == "MAR":
+        others = [k for k in range(len(frame.columns)) if k != j]
+        return others[rng.integers(len(others))] if len(others) > 0 else j
+    if sampling == "MNAR":
+        return j
+    raise ValueError(f"Unknown sampling {sampling}.")
+
+
+def nested_row_order(
+    frame: EncodedFrame, j: int, sampling: str, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Order all row positions of column j such that the first n rows are the
+    rows to corrupt at any n. For MCAR, that is a random permutation. For MAR
+    and MNAR, the window of rows grows around a random center of the sorted
+    column, so each prefix is a contiguous window like the ones sample_rows
+    draws.
+    """
+    n_rows = len(frame)
+    if sampling == "MCAR":
+        return rng.permutation(n_rows)
+    depends_on = _depends_on(frame, j, sampling, rng)
+    center = rng.integers(n_rows)
+    positions = np.arange(n_rows)
+    # alternate between the left and right end of the window
+    distance = np.abs(positions - center) + 0.5 * (positions < center)
+    return frame.orders[depends_on][np.argsort(distance, kind="stable")]
+
+
+def derangement(n: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    A random permutation of range(n) that moves every element, drawn
+    uniformly by rejection. The identity for n < 2, where there is none.
+    """
+    if n < 2:
+        return np.arange(n)
+    while True:
+        permutation = rng.permutation(n)
+        if not np.any(permutation == np.arange(n)):
+            return permutation
+
+
+def categorical_shift(
+    frame: EncodedFrame, sampling: str, fraction: float, rng: np.random.Generator
+) -> pd.DataFrame:
+    """
+    Corrupt all columns of frame the way Jenga's CategoricalShift does: in the
+    sampled rows, each value is replaced by the value of a random permutation
+    of the column's categories. Rows are sampled on the clean frame.
+    """
+    dirty_codes = []
+    for j, codes in enumerate(frame.codes):
+        rows = sample_rows(frame, j, fraction, sampling, rng)
+        permutation = rng.permutation(len(frame.uniques[j]))
+        column_codes = codes.copy()
+        selected = column_codes[rows]
+        column_codes[rows] = np.where(selected < 0, selected, permutation[selected])
+        dirty_codes.append(column_codes)
+    return frame.decode(dirty_codes)
+
+
+# Set in each Pool worker by _init_corruption_worker.
+_encoded_frame = None
+
+
+def _init_corruption_worker(frame: EncodedFrame):
+    global _encoded_frame
+    _encoded_frame = frame
+
+
+def _corrupt_to_csv(
+    sampling: str, fraction: float, seed: np.random.SeedSequence, path: Path
+) -> Path:
+    rng = np.random.default_rng(seed)
+    df_dirty = categorical_shift(_encoded_frame, sampling, fraction, rng)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df_dirty.to_csv(path, index=True)
+    return path
 
 
 class Corruptor:
@@ -10,13 +147,16 @@ class Corruptor:
     Run Jenga to corrupt a dataset.
     """
 
-    def __init__(self, dataset_name: str):
+    def __init__(self, dataset_name: str, seed: Union[None, int] = None):
         self.dataset_path = Path(dataset_name + ".csv")
+        self.seed = seed
         self.export_root = Path(dataset_name)
         self.samplings = ["MCAR", "MAR", "MNAR"]
         self.fractions = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.99]
 
     def run(self):
+        from jenga.corruptions.generic import CategoricalShift
+
         df = pd.read_csv(self.dataset_path, sep=",")
         df = df.astype(str)
 
@@ -35,6 +175,105 @@ class Corruptor:
                 )
         df.to_csv(self.export_root / "clean.csv", index=True)
 
+    def _dirty_path(self, sampling: str, fraction: float) -> Path:
+        formatted_fraction = str(fraction).split(".")[1]
+        return self.export_root / Path(sampling) / f"dirty_{formatted_fraction}.csv"
+
+    def run_vectorised(self, workers: Union[None, int] = None) -> List[Path]:
+        """
+        Same output as run, but computed without Jenga: the dataset is
+        factorised once, and all columns of a (sampling, fraction) cell are
+        corrupted in one pass over integer codes. Cells are corrupted and
+        written on a Pool using all cores, pass workers=1 to stay in this
+        process.
+
+        Each cell draws from its own random generator spawned from
+        self.seed, so the output only depends on the seed, not on the number
+        of workers.
+        """
+        df = pd.read_csv(self.dataset_path, sep=",")
+        df = df.astype(str)
+        frame = EncodedFrame(df)
+
+        cells: List[Tuple[str, float]] = [
+            (s, f) for s in self.samplings for f in self.fractions
+        ]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(cells))
+        tasks = [
+            (s, f, seed, self._dirty_path(s, f)) for (s, f), seed in zip(cells, seeds)
+        ]
+        if workers == 1:
+            _init_corruption_worker(frame)
+            paths = [_corrupt_to_csv(*task) for task in tasks]
+        else:
+            with Pool(
+                workers, initializer=_init_corruption_worker, initargs=(frame,)
+            ) as pool:
+                paths = pool.starmap(_corrupt_to_csv, tasks)
+        df.to_csv(self.export_root / "clean.csv", index=True)
+        return paths
+
+    def run_nested(self, error_token=None) -> List[Path]:
+        """
+        Instead of a dirty csv per fraction, draw one permutation of all cells
+        per sampling strategy and store the errors in that order, see
+        ruska.errorstore.NestedErrorStore. The errors at a fraction are the
+        first fraction of the permutation, so lower fractions' errors are a
+        subset of higher fractions' errors and fraction sweeps stay
+        comparable.
+
+        Cells are interleaved across columns, so each prefix corrupts about the
+        same fraction of every column. Errors are categorical shifts to a
+        derangement of the column's categories, so that every error changes
+        the value, or error_token if one is passed. Cells an error cannot
+        change, in columns with a single category or holding error_token, are
+        left out of the permutation.
+        """
+        df = pd.read_csv(self.dataset_path, sep=",")
+        df = df.astype(str)
+        frame = EncodedFrame(df)
+        n_rows, n_cols = df.shape
+
+        paths = []
+        seeds = np.random.SeedSequence(self.seed).spawn(len(self.samplings))
+        for s, seed in zip(self.samplings, seeds):
+            rng = np.random.default_rng(seed)
+            ranks = np.empty((n_rows, n_cols), dtype=np.float64)
+            dirty_codes = np.zeros((n_rows, n_cols), dtype=np.int32)
+            changes = np.ones((n_rows, n_cols), dtype=bool)
+            values = []
+            for j in range(n_cols):
+                row_order = nested_row_order(frame, j, s, rng)
+                ranks[row_order, j] = np.arange(n_rows)
+                if error_token is None:
+                    uniques = frame.uniques[j]
+                    permutation = derangement(len(uniques), rng)
+                    codes = frame.codes[j]
+                    dirty_codes[:, j] = np.where(codes < 0, 0, permutation[codes])
+                    changes[:, j] = (codes >= 0) & (dirty_codes[:, j] != codes)
+                    values.append(uniques.tolist())
+                else:
+                    changes[:, j] = df.iloc[:, j].to_numpy() != error_token
+                    values.append([error_token])
+            # break ties between columns randomly
+            ranks += rng.random(ranks.shape)
+            order = np.argsort(ranks, axis=None, kind="stable")
+            order = order[changes.ravel()[order]]
+            rows, cols = np.divmod(order, n_cols)
+            path = write_nested_errors(
+                self.export_root / "nested" / s,
+                s,
+                rows,
+                cols,
+                dirty_codes.ravel()[order],
+                values,
+                list(df.columns),
+                n_rows,
+            )
+            paths.append(path)
+        df.to_csv(self.export_root / "clean.csv", index=True)
+        return paths
+
     def run_simple_mcar(self):
         """
         Jenga is buggy, so this is my stupid MCAR implementation. I used
@@ -0,0 +1,55 @@
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Union
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Datasets published in this process, see publish_datasets.
+_datasets: Dict[str, "pd.DataFrame"] = {}
+
+
+def load_datasets(specs: Dict[str, Union[str, dict]]) -> Dict[str, "pd.DataFrame"]:
+    """
+    Read each dataset once. specs maps a dataset's name to the path of a csv
+    file, or to a dict with the key 'path' and further keyword arguments for
+    pd.read_csv, e.g.
+    {'hospital_clean': 'sample_data/hospital_1k_clean.csv',
+     'hospital_dirty': {'path': 'sample_data/hospital_1k_dirty.csv', 'dtype': 'str'}}
+    """
+    import pandas as pd
+
+    logger = logging.getLogger(__name__)
+    frames = {}
+    for name, spec in specs.items():
+        kwargs = {"path": spec} if isinstance(spec, (str, Path)) else dict(spec)
+        path = kwargs.pop("path")
+        frames[name] = pd.read_csv(path, **kwargs)
+        logger.info(f"Loaded dataset {name} from {path}.")
+    return frames
+
+
+def publish_datasets(frames: Dict[str, "pd.DataFrame"]) -> None:
+    """
+    Make datasets available to get_dataset in this process. Ruska.run calls
+    this in the parent process before the Pool forks its workers, so that the
+    workers share the parent's memory pages instead of reading the csv files
+    again. Without fork, the datasets are handed to each worker once when it
+    starts.
+    """
+    _datasets.clear()
+    _datasets.update(frames)
+
+
+def get_dataset(name: str) -> "pd.DataFrame":
+    """
+    Get a dataset that Ruska loaded for the experiments. The same DataFrame
+    is shared by all configurations measured in a process, so copy it before
+    changing it in-place, e.g. when inserting errors.
+    """
+    try:
+        return _datasets[name]
+    except KeyError:
+        raise KeyError(
+            f"Ruska has no dataset called {name}. Pass it to Ruska(datasets=...)."
+        ) from None
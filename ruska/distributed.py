@@ -0,0 +1,311 @@
+"""
+Measure a grid on several machines. Ruska.run(coordinator=(host, port))
+serves the configurations of a measurement over a socket, and any number of
+workers lease configurations, measure them and send back results:
+
+    RUSKA_AUTHKEY=secret python -m ruska.distributed coordinator-host:6000 \\
+        my_experiments:experiment --processes 16
+
+Workers send heartbeats while they measure. Configurations whose lease
+expires, because the worker died or lost its connection, are leased to
+another worker.
+"""
+import os
+import sys
+import time
+import queue
+import pickle
+import logging
+import argparse
+import importlib
+import itertools
+import threading
+import collections
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client
+from typing import Callable, Iterable, Iterator, Tuple, Union
+from ruska.datasets import load_datasets, publish_datasets
+from ruska.executor import run_experiment, worker_id, _check_max_rss
+
+
+def _authkey(authkey: Union[None, bytes]) -> bytes:
+    if authkey is None:
+        authkey = os.environ.get("RUSKA_AUTHKEY", "").encode() or None
+    if authkey is None:
+        raise ValueError(
+            "Coordinator and workers need a shared authkey. Pass it or set "
+            "the environment variable RUSKA_AUTHKEY."
+        )
+    return authkey
+
+
+class Coordinator:
+    """
+    Serves tasks to workers and collects their results. Tasks are only taken
+    from the iterable when a worker asks for one.
+    """
+
+    def __init__(
+        self,
+        tasks: Iterable[Tuple[int, dict]],
+        address: Tuple[str, int],
+        authkey: Union[None, bytes] = None,
+        lease_timeout: float = 60.0,
+        worker_config: Union[None, dict] = None,
+    ):
+        self.tasks = iter(tasks)
+        self.lease_timeout = lease_timeout
+        self.worker_config = worker_config or {}
+        self.listener = Listener(address, authkey=_authkey(authkey))
+
+        self.lock = threading.Lock()
+        self.requeued = collections.deque()
+        self.leases = {}  # lease id -> (index, config, expiry)
+        self.lease_ids = itertools.count()
+        self.done = set()
+        self.tasks_exhausted = False
+        self.results = queue.Queue()
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def _next_task(self) -> Union[None, Tuple[int, dict]]:
+        if len(self.requeued) > 0:
+            return self.requeued.popleft()
+        if not self.tasks_exhausted:
+            try:
+                return next(self.tasks)
+            except StopIteration:
+                self.tasks_exhausted = True
+        return None
+
+    def _finished(self) -> bool:
+        with self.lock:
+            if len(self.requeued) > 0 or len(self.leases) > 0:
+                return False
+            if not self.tasks_exhausted:
+                task = self._next_task()
+                if task is not None:
+                    self.requeued.append(task)
+                    return False
+            return True
+
+    def _handle(self, message: tuple) -> tuple:
+        kind = message[0]
+        with self.lock:
+            if kind == "hello":
+                return ("config", self.worker_config)
+            if kind == "lease":
+                task = self._next_task()
+                if task is None:
+                    if len(self.leases) == 0:
+                        return ("stop",)
+                    return ("wait", 1.0)  # expiring leases might be requeued
+                lease_id = next(self.lease_ids)
+                i, config = task
+                self.leases[lease_id] = (i, config, time.time() + self.lease_timeout)
+                return ("task", lease_id, i, config, self.lease_timeout / 3)
+            if kind == "heartbeat":
+                lease_id = message[1]
+                if lease_id not in self.leases:
+                    return ("expired",)
+                i, config, _ = self.leases[lease_id]
+                self.leases[lease_id] = (i, config, time.time() + self.lease_timeout)
+                return ("ok",)
+            if kind == "result":
+                _, lease_id, i, result, stats = message
+                self.leases.pop(lease_id, None)
+                if i not in self.done:
+                    self.done.add(i)
+                    self.results.put((i, result, stats))
+                return ("ok",)
+        raise ValueError(f"Unknown message {kind}.")
+
+    def _serve_connection(self, connection):
+        logger = logging.getLogger(__name__)
+        try:
+            while True:
+                message = connection.recv()
+                connection.send(self._handle(message))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.error(f"Dropping a worker connection: {e!r}")
+        finally:
+            connection.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:  # the listener was closed
+                return
+            except Exception:  # e.g. a client with the wrong authkey
+                continue
+            threading.Thread(
+                target=self._serve_connection, args=(connection,), daemon=True
+            ).start()
+
+    def _requeue_expired(self):
+        logger = logging.getLogger(__name__)
+        now = time.time()
+        with self.lock:
+            for lease_id, (i, config, expiry) in list(self.leases.items()):
+                if expiry < now:
+                    del self.leases[lease_id]
+                    if i not in self.done:
+                        logger.warning(f"Lease on configuration {i} expired, requeuing.")
+                        self.requeued.append((i, config))
+
+    def results_as_completed(self) -> Iterator[Tuple[int, object, Union[None, dict]]]:
+        """
+        Serve tasks until all of them are measured and yield (index, result,
+        stats) tuples as workers report them.
+        """
+        logger = logging.getLogger(__name__)
+        logger.info(f"Serving configurations at {self.address}.")
+        threading.Thread(target=self._accept, daemon=True).start()
+        try:
+            while True:
+                try:
+                    yield self.results.get(timeout=1.0)
+                    continue
+                except queue.Empty:
+                    pass
+                self._requeue_expired()
+                if self._finished() and self.results.empty():
+                    return
+        finally:
+            # wait a moment for idle workers to be told to stop
+            time.sleep(2.0)
+            self.listener.close()
+
+
+def run_distributed(
+    tasks: Iterable[Tuple[int, dict]],
+    address: Tuple[str, int],
+    authkey: Union[None, bytes] = None,
+    lease_timeout: float = 60.0,
+    worker_config: Union[None, dict] = None,
+) -> Iterator[Tuple[int, object, Union[None, dict]]]:
+    coordinator = Coordinator(tasks, address, authkey, lease_timeout, worker_config)
+    yield from coordinator.results_as_completed()
+
+
+def work(
+    experiment: Callable,
+    address: Tuple[str, int],
+    authkey: Union[None, bytes] = None,
+    retry_for: float = 60.0,
+) -> int:
+    """
+    Lease configurations from a coordinator and measure them until the
+    coordinator has no more configurations. Connecting is retried for
+    retry_for seconds, so workers may be started before the coordinator.
+    Returns the number of measured configurations.
+    """
+    logger = logging.getLogger(__name__)
+    authkey = _authkey(authkey)
+    deadline = time.time() + retry_for
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(1.0)
+
+    lock = threading.Lock()
+
+    def request(message: tuple) -> tuple:
+        with lock:
+            connection.send(message)
+            return connection.recv()
+
+    def heartbeat(lease_id: int, interval: float, stop: threading.Event):
+        try:
+            while not stop.wait(interval):
+                if request(("heartbeat", lease_id))[0] == "expired":
+                    return
+        except (EOFError, OSError):
+            return
+
+    _, config = request(("hello", worker_id()))
+    if config.get("datasets") is not None:
+        publish_datasets(load_datasets(config["datasets"]))
+    timeout, max_rss = config.get("timeout"), config.get("max_rss")
+    _check_max_rss(max_rss)
+    profile = config.get("profile")
+
+    n_measured = 0
+    try:
+        while True:
+            reply = request(("lease", worker_id()))
+            if reply[0] == "stop":
+                break
+            if reply[0] == "wait":
+                time.sleep(reply[1])
+                continue
+            _, lease_id, i, experiment_config, interval = reply
+            stop = threading.Event()
+            beat = threading.Thread(
+                target=heartbeat, args=(lease_id, interval, stop), daemon=True
+            )
+            beat.start()
+            _, result, stats = run_experiment(
+                experiment, i, experiment_config, timeout, max_rss, profile
+            )
+            stop.set()
+            beat.join()
+            message = ("result", lease_id, i, result, stats)
+            try:
+                pickle.dumps(message)
+            except Exception as e:
+                message = ("result", lease_id, i, RuntimeError(repr(e)), stats)
+            request(message)
+            n_measured += 1
+    except (EOFError, OSError):
+        logger.warning(f"Lost the connection to the coordinator at {address}.")
+    finally:
+        connection.close()
+    logger.info(f"Worker {worker_id()} measured {n_measured} configurations.")
+    return n_measured
+
+
+def _import_experiment(spec: str) -> Callable:
+    module_name, function_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _work_from_spec(spec: str, address: Tuple[str, int]):
+    work(_import_experiment(spec), address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure configurations served by a Ruska coordinator."
+    )
+    parser.add_argument("address", help="host:port of the coordinator")
+    parser.add_argument("experiment", help="module:function of the experiment")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    host, port = args.address.rsplit(":", 1)
+    address = (host, int(port))
+    logging.basicConfig(level=logging.INFO)
+    _import_experiment(args.experiment)  # fail early on typos
+    processes = [
+        Process(target=_work_from_spec, args=(args.experiment, address))
+        for _ in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    return 0 if all(p.exitcode == 0 for p in processes) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
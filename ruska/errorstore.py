@@ -0,0 +1,157 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple, Union
+
+
+def write_nested_errors(
+    path: Union[str, Path],
+    sampling: str,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    value_codes: np.ndarray,
+    values: List[list],
+    columns: list,
+    n_rows: int,
+) -> Path:
+    """
+    Store errors as three parallel arrays, ordered by the cell permutation of
+    a sampling strategy: the first round(fraction * n_cells) entries are the
+    errors at that fraction. The dirty value of an error is values[col][code].
+
+    An index sorted by row is stored next to them, so that the errors in a
+    range of rows can be read without reading all errors.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    row_dtype = np.int32 if n_rows < 2**31 else np.int64
+    np.save(path / "rows.npy", rows.astype(row_dtype))
+    np.save(path / "cols.npy", cols.astype(np.int32))
+    np.save(path / "codes.npy", value_codes.astype(np.int32))
+    by_row = np.argsort(rows, kind="stable")
+    np.save(path / "by_row.npy", by_row.astype(np.int64))
+    np.save(path / "sorted_rows.npy", rows[by_row].astype(row_dtype))
+    meta = {
+        "sampling": sampling,
+        "n_rows": n_rows,
+        "columns": [str(c) for c in columns],
+        "values": values,
+    }
+    with open(path / "meta.json", "w") as f:
+        json.dump(meta, f)
+    return path
+
+
+def apply_errors(
+    df: pd.DataFrame, rows: np.ndarray, cols: np.ndarray, dirty_values: np.ndarray
+) -> pd.DataFrame:
+    """A copy of df with the values at positions (rows, cols) replaced."""
+    df_dirty = df.copy()
+    for j in np.unique(cols):
+        selected = cols == j
+        df_dirty.iloc[rows[selected], j] = dirty_values[selected]
+    return df_dirty
+
+
+class NestedErrorStore:
+    """
+    Errors of a sampling strategy at all fractions at once, written by
+    Corruptor.run_nested. Errors at a lower fraction are a subset of the
+    errors at a higher fraction. Any fraction is rebuilt by reading a prefix
+    of memory-mapped arrays, without touching the errors beyond it.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / "meta.json") as f:
+            meta = json.load(f)
+        self.sampling = meta["sampling"]
+        self.n_rows = meta["n_rows"]
+        self.columns = meta["columns"]
+        self.values = [np.array(v, dtype=object) for v in meta["values"]]
+        self._rows = np.load(self.path / "rows.npy", mmap_mode="r")
+        self._cols = np.load(self.path / "cols.npy", mmap_mode="r")
+        self._codes = np.load(self.path / "codes.npy", mmap_mode="r")
+        if (self.path / "by_row.npy").exists():
+            self._by_row = np.load(self.path / "by_row.npy", mmap_mode="r")
+            self._sorted_rows = np.load(self.path / "sorted_rows.npy", mmap_mode="r")
+        else:  # written before the index existed
+            self._by_row = np.argsort(self._rows, kind="stable")
+            self._sorted_rows = self._rows[self._by_row]
+
+    @property
+    def n_cells(self) -> int:
+        return self.n_rows * len(self.columns)
+
+    def n_errors(self, fraction: float) -> int:
+        if fraction > 1:
+            raise ValueError("Cannot turn more than 100% of the values into errors.")
+        return min(round(self.n_cells * fraction), len(self._rows))
+
+    def errors(self, fraction: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Row positions, column positions and dirty values of the errors."""
+        k = self.n_errors(fraction)
+        rows = np.asarray(self._rows[:k])
+        cols = np.asarray(self._cols[:k])
+        return rows, cols, self._decode(cols, np.asarray(self._codes[:k]))
+
+    def _decode(self, cols: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        dirty_values = np.empty(len(cols), dtype=object)
+        for j in np.unique(cols):
+            selected = cols == j
+            dirty_values[selected] = self.values[j][codes[selected]]
+        return dirty_values
+
+    def error_mask(self, fraction: float, index=None) -> pd.DataFrame:
+        rows, cols, _ = self.errors(fraction)
+        mask = np.zeros((self.n_rows, len(self.columns)), dtype=bool)
+        mask[rows, cols] = True
+        return pd.DataFrame(mask, index=index, columns=self.columns)
+
+    def read_clean(self) -> pd.DataFrame:
+        """The clean dataset, as Corruptor exports it next to the stores."""
+        return pd.read_csv(self.path.parent.parent / "clean.csv", index_col=0, dtype=str)
+
+    def dirty(self, fraction: float, clean: Union[None, pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Rebuild the dirty dataset at fraction. Reads the clean dataset from
+        disk unless it is passed.
+        """
+        clean = self.read_clean() if clean is None else clean
+        return apply_errors(clean, *self.errors(fraction))
+
+    def errors_in_rows(
+        self, fraction: float, start: int, stop: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Same as errors, restricted to the rows at positions start to stop and
+        sorted by row position. Only reads the errors in those rows.
+        """
+        k = self.n_errors(fraction)
+        lo, hi = np.searchsorted(self._sorted_rows, [start, stop])
+        positions = np.asarray(self._by_row[lo:hi])
+        selected = positions < k
+        positions = positions[selected]
+        rows = np.asarray(self._sorted_rows[lo:hi])[selected]
+        cols = np.asarray(self._cols[positions])
+        return rows, cols, self._decode(cols, np.asarray(self._codes[positions]))
+
+    def errors_by_row(self, fraction: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Same as errors, sorted by row position."""
+        return self.errors_in_rows(fraction, 0, self.n_rows)
+
+    def dirty_chunks(
+        self, fraction: float, clean_chunks: Iterable[pd.DataFrame]
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Rebuild the dirty dataset at fraction chunk by chunk, from consecutive
+        row chunks of the clean dataset, e.g. pd.read_csv(..., chunksize=n).
+        Only the errors of the current chunk are held in memory.
+        """
+        start = 0
+        for chunk in clean_chunks:
+            stop = start + len(chunk)
+            rows, cols, dirty_values = self.errors_in_rows(fraction, start, stop)
+            yield apply_errors(chunk, rows - start, cols, dirty_values)
+            start = stop
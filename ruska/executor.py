@@ -0,0 +1,450 @@
+import gc
+import os
+import sys
+import time
+import queue
+import pickle
+import signal
+import socket
+import cProfile
+import logging
+import marshal
+import itertools
+import threading
+import traceback
+from multiprocessing import Pool, SimpleQueue
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from ruska.datasets import publish_datasets
+
+
+class ExperimentFailure(Exception):
+    """
+    Recorded as the result of a configuration that Ruska had to stop.
+    """
+
+
+class ExperimentTimeout(ExperimentFailure):
+    pass
+
+
+class MemoryLimitExceeded(ExperimentFailure):
+    pass
+
+
+class WorkerLost(ExperimentFailure):
+    pass
+
+
+def _rss(pid: Union[None, int] = None) -> Union[None, int]:
+    """Resident set size of a process in bytes, None if it cannot be read."""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _check_max_rss(max_rss: Union[None, int]) -> None:
+    """Warn that max_rss will not be enforced if there is no RSS to read."""
+    if max_rss is not None and _rss() is None:
+        logger = logging.getLogger(__name__)
+        logger.warning(
+            f"Cannot read the memory use of processes on this platform, the "
+            f"limit max_rss={max_rss} will not be enforced."
+        )
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the peak resident set size of this process, Linux only. Returns
+    whether it was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> Union[None, int]:
+    """
+    Peak resident set size of this process in bytes since the last
+    successful _reset_peak_rss, or else over the process' lifetime. None
+    where neither /proc nor the resource module are available, e.g. Windows.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource  # not available on Windows
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (ImportError, OSError, ValueError):
+        return None
+    # bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def should_profile(profile: Union[None, bool, Callable[[dict], bool]], config: dict) -> bool:
+    if callable(profile):
+        return bool(profile(config))
+    return bool(profile)
+
+
+class _Watchdog:
+    """
+    Checks on the configuration that is being measured every second and
+    raises ExperimentTimeout or MemoryLimitExceeded inside the experiment
+    when it exceeds its limits. Should the experiment swallow the exception,
+    it is raised again on the next check.
+
+    Relies on SIGALRM, so it only works in the main thread of a process.
+    """
+
+    def __init__(self, i: int, timeout: Union[None, float], max_rss: Union[None, int]):
+        self.i = i
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.failure = None
+        self.active = False
+
+    def __enter__(self):
+        if self.timeout is None and self.max_rss is None:
+            return self
+        if threading.current_thread() is not threading.main_thread():
+            logger = logging.getLogger(__name__)
+            logger.warning("Cannot enforce limits outside of the main thread.")
+            return self
+        self.active = True
+        self.start = time.monotonic()
+        interval = 1.0 if self.timeout is None else min(1.0, self.timeout)
+        self.previous_handler = signal.signal(signal.SIGALRM, self._check)
+        signal.setitimer(signal.ITIMER_REAL, interval, interval)
+        return self
+
+    def _check(self, signum, frame):
+        if self.timeout is not None and time.monotonic() - self.start > self.timeout:
+            self.failure = ExperimentTimeout(
+                f"Configuration {self.i} exceeded the timeout of {self.timeout}s."
+            )
+            raise self.failure
+        if self.max_rss is not None:
+            rss = _rss()
+            if rss is not None and rss > self.max_rss:
+                self.failure = MemoryLimitExceeded(
+                    f"Configuration {self.i} used {rss} bytes of memory, more "
+                    f"than the limit of {self.max_rss} bytes."
+                )
+                raise self.failure
+
+    def __exit__(self, *args):
+        if self.active:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous_handler)
+            self.active = False
+
+
+def run_experiment(
+    experiment: Callable,
+    i: int,
+    config: dict,
+    timeout: Union[None, float] = None,
+    max_rss: Union[None, int] = None,
+    profile: Union[None, bool, Callable[[dict], bool]] = None,
+) -> Tuple[int, object, dict]:
+    """
+    Measure a single configuration and return a tuple (index, result, stats).
+    stats holds the wall_time and cpu_time of the measurement in seconds,
+    the peak_rss of the process during the measurement in bytes and the
+    worker that measured it, as host:pid. Where the peak cannot be reset
+    before the measurement, e.g. outside of Linux, peak_rss is the peak over
+    the lifetime of the process and peak_rss_lifetime is True. An exception raised by the
+    experiment becomes its result, with the formatted traceback attached as
+    the attribute ruska_traceback.
+
+    Optionally, the measurement is stopped after timeout seconds or when the
+    process uses more than max_rss bytes of memory. The result then is an
+    ExperimentTimeout or MemoryLimitExceeded exception.
+
+    If profile is True, or a function that returns True for config, the
+    experiment runs under cProfile and stats['profile'] holds the profile,
+    marshalled the way pstats reads it from a file.
+    """
+    watchdog = _Watchdog(i, timeout, max_rss)
+    profiler = cProfile.Profile() if should_profile(profile, config) else None
+    peak_rss_reset = _reset_peak_rss()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        with watchdog:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                result = experiment(i, config)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    except Exception as e:
+        e.ruska_traceback = traceback.format_exc()
+        try:
+            # Exceptions with custom __init__ signatures don't survive the
+            # trip back from a worker, which would stall the Pool.
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            e_plain = RuntimeError(repr(e))
+            e_plain.ruska_traceback = e.ruska_traceback
+            e = e_plain
+        result = e
+    if watchdog.failure is not None and result is not watchdog.failure:
+        result = watchdog.failure  # the experiment swallowed the failure
+    stats = {
+        "wall_time": time.perf_counter() - start,
+        "cpu_time": time.process_time() - cpu_start,
+        "peak_rss": _peak_rss(),
+        "peak_rss_lifetime": not peak_rss_reset,
+        "worker": worker_id(),
+    }
+    if profiler is not None:
+        profiler.create_stats()
+        stats["profile"] = marshal.dumps(profiler.stats)
+    return i, result, stats
+
+
+def run_sequential(
+    experiment: Callable,
+    tasks: Iterable[Tuple[int, dict]],
+    timeout: Union[None, float] = None,
+    max_rss: Union[None, int] = None,
+    profile: Union[None, bool, Callable[[dict], bool]] = None,
+) -> Iterator[Tuple[int, object, dict]]:
+    _check_max_rss(max_rss)
+    for i, config in tasks:
+        yield run_experiment(experiment, i, config, timeout, max_rss, profile)
+
+
+# Set in each Pool worker by _init_worker.
+_worker_events = None
+_worker_limits = (None, None, None)
+
+
+def _init_worker(events: SimpleQueue, timeout, max_rss, profile, datasets):
+    global _worker_events, _worker_limits
+    _worker_events = events
+    _worker_limits = (timeout, max_rss, profile)
+    if datasets is not None:
+        publish_datasets(datasets)
+
+
+def _run_chunk(experiment: Callable, chunk_id: int, chunk: List[Tuple[int, dict]]):
+    """
+    Measure a chunk of configurations in a worker. Tells the parent which
+    chunk and configuration the worker is busy with, so that the parent can
+    tell which ones were lost when the worker dies.
+    """
+    pid = os.getpid()
+    results = []
+    for i, config in chunk:
+        _worker_events.put((pid, chunk_id, i, time.time()))
+        results.append(run_experiment(experiment, i, config, *_worker_limits))
+        _worker_events.put((pid, chunk_id, i, None))
+    return results
+
+
+def run_parallel(
+    experiment: Callable,
+    tasks: Iterable[Tuple[int, dict]],
+    workers: Union[None, int] = None,
+    chunksize: int = 1,
+    timeout: Union[None, float] = None,
+    max_rss: Union[None, int] = None,
+    maxtasksperchild: Union[None, int] = None,
+    datasets: Union[None, dict] = None,
+    profile: Union[None, bool, Callable[[dict], bool]] = None,
+) -> Iterator[Tuple[int, object, Union[None, dict]]]:
+    """
+    Measure configurations on a Pool and yield (index, result, stats) tuples
+    in the order in which they finish, which is not the order of tasks.
+    Configurations whose worker was lost have no stats.
+
+    Configurations are sent to the workers in chunks of chunksize, and only a
+    few chunks per worker are in flight at any time. Workers enforce timeout
+    and max_rss themselves. Should a worker die or stop responding, the
+    configuration it was busy with is recorded as WorkerLost,
+    ExperimentTimeout or MemoryLimitExceeded and the rest of its chunk is
+    measured again. Should a worker die after it measured a chunk, but before
+    the results arrived, e.g. while pickling them, its configurations are
+    recorded as WorkerLost. After measuring maxtasksperchild configurations,
+    a worker is replaced by a fresh process. Workers are only replaced
+    between chunks, so the limit is rounded down to whole chunks, but a
+    worker always measures at least one chunk.
+
+    datasets are published to the workers, see ruska.datasets. See
+    run_experiment for stats and profile.
+    """
+    logger = logging.getLogger(__name__)
+    workers = workers or os.cpu_count()
+    logger.info(f"Starting a Pool with {workers} workers.")
+    _check_max_rss(max_rss)
+
+    tasks = iter(tasks)
+    events = SimpleQueue()
+    finished_chunks = queue.Queue()
+    chunks: Dict[int, List[Tuple[int, dict]]] = {}
+    chunk_ids = itertools.count()
+    owner: Dict[int, int] = {}  # chunk id -> pid, until its results arrive
+    started: Dict[int, set] = {}  # chunk id -> indexes the worker started
+    busy: Dict[int, Tuple[int, int, float]] = {}  # pid -> (chunk id, index, start)
+    dead_since: Dict[int, float] = {}  # chunk id -> when its owner was found dead
+    # the worker only gets killed when its own watchdog did not fire in time
+    grace = None if timeout is None else timeout + max(10.0, timeout / 10)
+    # a worker that exits right after it sent its results, e.g. because of
+    # maxtasksperchild, isn't lost, the results are just not here yet
+    delivery_grace = 5.0
+    # the Pool counts chunks, not configurations
+    chunks_per_child = None
+    if maxtasksperchild is not None:
+        chunks_per_child = max(1, maxtasksperchild // chunksize)
+
+    # Keep the garbage collector of forked workers from touching, and thereby
+    # copying, the memory pages of the parent's datasets.
+    gc.freeze()
+    pool = Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(events, timeout, max_rss, profile, datasets),
+        maxtasksperchild=chunks_per_child,
+    )
+    gc.unfreeze()
+
+    def submit(chunk: List[Tuple[int, dict]]):
+        chunk_id = next(chunk_ids)
+        chunks[chunk_id] = chunk
+        pool.apply_async(
+            _run_chunk,
+            (experiment, chunk_id, chunk),
+            callback=lambda r: finished_chunks.put((chunk_id, r)),
+            error_callback=lambda e: finished_chunks.put((chunk_id, e)),
+        )
+
+    def fill():
+        while len(chunks) < 2 * workers:
+            chunk = list(itertools.islice(tasks, chunksize))
+            if len(chunk) == 0:
+                return
+            submit(chunk)
+
+    def forget(chunk_id: int):
+        owner.pop(chunk_id, None)
+        started.pop(chunk_id, None)
+        dead_since.pop(chunk_id, None)
+        return chunks.pop(chunk_id)
+
+    def abandon(pid: int, failure: ExperimentFailure):
+        """
+        Record the configuration a dead worker was busy with as failed and
+        measure the rest of its chunk again.
+        """
+        chunk_id, i, _ = busy.pop(pid)
+        chunk = forget(chunk_id)
+        rest = [(j, config) for j, config in chunk if j != i]
+        if len(rest) > 0:
+            submit(rest)
+        return i, failure, None
+
+    def abandon_undelivered(chunk_id: int):
+        """
+        Record the configurations a dead worker measured, but whose results
+        never arrived, as lost and measure the ones it didn't start again.
+        """
+        done = started.get(chunk_id, set())
+        chunk = forget(chunk_id)
+        rest = [(j, config) for j, config in chunk if j not in done]
+        if len(rest) > 0:
+            submit(rest)
+        for j, _ in chunk:
+            if j in done:
+                yield j, WorkerLost(
+                    f"The worker that measured configuration {j} died before "
+                    "it delivered the result."
+                ), None
+
+    try:
+        fill()
+        while len(chunks) > 0:
+            try:
+                chunk_id, chunk_results = finished_chunks.get(timeout=1.0)
+            except queue.Empty:
+                chunk_id, chunk_results = None, None
+
+            if chunk_id is not None and chunk_id in chunks:
+                chunk = forget(chunk_id)
+                if isinstance(chunk_results, Exception):
+                    # e.g. a result that cannot be pickled
+                    chunk_results = [(i, chunk_results, None) for i, _ in chunk]
+                yield from chunk_results
+
+            while not events.empty():
+                pid, chunk_id, i, start = events.get()
+                if chunk_id not in chunks:
+                    continue  # a late event of a chunk that was abandoned
+                if start is None:
+                    if busy.get(pid, (None, None))[1] == i:
+                        del busy[pid]
+                else:
+                    owner[chunk_id] = pid
+                    started.setdefault(chunk_id, set()).add(i)
+                    busy[pid] = (chunk_id, i, start)
+
+            for pid, (chunk_id, i, start) in list(busy.items()):
+                if chunk_id not in chunks:
+                    del busy[pid]
+                    continue
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    yield abandon(
+                        pid, WorkerLost(f"The worker measuring configuration {i} died.")
+                    )
+                    continue
+                if grace is not None and time.time() - start > grace:
+                    os.kill(pid, signal.SIGKILL)
+                    yield abandon(
+                        pid,
+                        ExperimentTimeout(
+                            f"Configuration {i} exceeded the timeout of {timeout}s."
+                        ),
+                    )
+                    continue
+                rss = None if max_rss is None else _rss(pid)
+                if rss is not None and rss > 1.5 * max_rss:
+                    os.kill(pid, signal.SIGKILL)
+                    yield abandon(
+                        pid,
+                        MemoryLimitExceeded(
+                            f"Configuration {i} used {rss} bytes of memory, more "
+                            f"than the limit of {max_rss} bytes."
+                        ),
+                    )
+
+            # Chunks whose worker is between configurations, or done with them
+            busy_chunks = {chunk_id for chunk_id, _, _ in busy.values()}
+            for chunk_id, pid in list(owner.items()):
+                if chunk_id in busy_chunks:
+                    continue
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    since = dead_since.setdefault(chunk_id, time.time())
+                    if time.time() - since > delivery_grace:
+                        yield from abandon_undelivered(chunk_id)
+            fill()
+    finally:
+        pool.terminate()
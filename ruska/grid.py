@@ -0,0 +1,129 @@
+import math
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+
+class Constraint:
+    """
+    A predicate that decides whether a combination of ranges is measured.
+
+    When keys are given, the predicate is evaluated as soon as all of these
+    keys have a value, and only those keys are guaranteed to be set in the
+    dict it receives. This prunes all combinations that share an infeasible
+    prefix at once. Without keys, the predicate receives full combinations.
+    """
+
+    def __init__(self, predicate: Callable[[dict], bool], keys: Union[None, List[str]] = None):
+        self.predicate = predicate
+        self.keys = keys
+
+
+def conditional_range(key: str, values: list, when: Dict[str, object]) -> Constraint:
+    """
+    Restrict the range of key to values for combinations that match when,
+    e.g. conditional_range('error_fraction', [0.1], when={'sampling': 'MNAR'}).
+    """
+
+    def predicate(combination: dict) -> bool:
+        if all(combination[k] == v for k, v in when.items()):
+            return combination[key] in values
+        return True
+
+    return Constraint(predicate, [key, *when])
+
+
+class ParameterGrid:
+    """
+    All combinations of ranges in the order of itertools.product, computed
+    lazily. Each combination has a stable index in the full product, which
+    is what len() and random access refer to. Iteration skips combinations
+    that violate a constraint.
+    """
+
+    def __init__(
+        self,
+        ranges: Dict[str, list],
+        constraints: Union[None, List[Union[Constraint, Callable[[dict], bool]]]] = None,
+    ):
+        self.keys = list(ranges.keys())
+        self.values = [list(v) for v in ranges.values()]
+        self.sizes = [len(v) for v in self.values]
+        # the last key changes fastest, as in itertools.product
+        self.strides = [math.prod(self.sizes[d + 1 :]) for d in range(len(self.keys))]
+        self.constraints: List[Constraint] = []
+        for constraint in constraints or []:
+            self.constrain(constraint)
+
+    def constrain(
+        self,
+        constraint: Union[Constraint, Callable[[dict], bool]],
+        keys: Union[None, List[str]] = None,
+    ) -> None:
+        if not isinstance(constraint, Constraint):
+            constraint = Constraint(constraint, keys)
+        unknown = [k for k in constraint.keys or [] if k not in self.keys]
+        if len(unknown) > 0:
+            raise ValueError(f"Constraint refers to keys without range: {unknown}.")
+        self.constraints.append(constraint)
+
+    def __len__(self):
+        """Number of combinations, including those violating constraints."""
+        return math.prod(self.sizes)
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Grid index {index} out of range.")
+        return {
+            key: values[(index // stride) % size]
+            for key, values, stride, size in zip(
+                self.keys, self.values, self.strides, self.sizes
+            )
+        }
+
+    def is_feasible(self, combination: dict) -> bool:
+        return all(c.predicate(combination) for c in self.constraints)
+
+    def count(self) -> int:
+        """Number of combinations that satisfy all constraints."""
+        if len(self.constraints) == 0:
+            return len(self)
+        return sum(1 for _ in self.indexed())
+
+    def __iter__(self) -> Iterator[dict]:
+        for _, combination in self.indexed():
+            yield combination
+
+    def indexed(self) -> Iterator[Tuple[int, dict]]:
+        """Yield (index, combination) for each combination satisfying all constraints."""
+        if len(self.keys) == 0:
+            if self.is_feasible({}):
+                yield 0, {}
+            return
+
+        # check each constraint at the depth where its last key gets a value
+        checks = [[] for _ in self.keys]
+        for constraint in self.constraints:
+            if constraint.keys:
+                depth = max(self.keys.index(k) for k in constraint.keys)
+            else:
+                depth = len(self.keys) - 1
+            checks[depth].append(constraint.predicate)
+
+        yield from self._search(0, 0, {}, checks)
+
+    def _search(
+        self, depth: int, index: int, combination: dict, checks: List[list]
+    ) -> Iterator[Tuple[int, dict]]:
+        key = self.keys[depth]
+        last = depth == len(self.keys) - 1
+        for position, value in enumerate(self.values[depth]):
+            combination[key] = value
+            if not all(check(combination) for check in checks[depth]):
+                continue
+            position_index = index + position * self.strides[depth]
+            if last:
+                yield position_index, dict(combination)
+            else:
+                yield from self._search(depth + 1, position_index, combination, checks)
+        combination.pop(key, None)
@@ -1,45 +1,76 @@
-import json
 import logging
+import warnings
 import urllib.parse
-import random
 import datetime
-import requests
 import numpy as np
 import pandas as pd
-from typing import List, Union, Callable
+from typing import List, Union
 from pathlib import Path
 
 
+def stack_runs(vectors: list, ragged: str = "error") -> np.ndarray:
+    """
+    Stack the metric vectors of several runs into one contiguous 2-D array
+    with a row per run. Vectors of different lengths raise a ValueError,
+    unless ragged is 'truncate', which cuts all vectors to the shortest, or
+    'pad', which pads them with NaN to the longest.
+    """
+    arrays = [np.asarray(v, dtype=np.float64) for v in vectors]
+    if len({a.shape for a in arrays}) == 1:
+        return np.stack(arrays)
+    if ragged == "error":
+        lengths = sorted({len(a) for a in arrays})
+        raise ValueError(
+            f"Runs have metric vectors of lengths {lengths}. Pass "
+            "ragged='truncate' or ragged='pad' to reduce them anyway."
+        )
+    if ragged == "truncate":
+        length = min(len(a) for a in arrays)
+        return np.stack([a[:length] for a in arrays])
+    if ragged == "pad":
+        stacked = np.full((len(arrays), max(len(a) for a in arrays)), np.nan)
+        for row, a in zip(stacked, arrays):
+            row[: len(a)] = a
+        return stacked
+    raise ValueError(f"Unknown ragged mode {ragged}.")
+
+
 def reduce_runs_list(
     result,
     config_of_interest=["dataset", "error_fraction"],
     metrics=["f1", "precision", "recall"],
     run_label="run",
+    ragged="error",
 ):
     """
     Same as reduce_runs, but when the performance_label doesn't yield a single float, but a
-    list of floats instead.
+    list of floats instead. Returns the average and the standard error per position of the
+    list. See stack_runs for lists of different lengths -- with ragged='pad', each position is
+    averaged over the runs that have a value there. Otherwise, a NaN in any run makes the
+    position NaN, like in reduce_runs.
     """
-    labels_of_interest = config_of_interest + [run_label] + metrics
-    result_enc = [
-        {**r["config"], **{m: json.dumps(r["result"][m]) for m in metrics}}
-        for r in result
-    ]
-    df = pd.DataFrame(
-        result_enc
-    )  # use pandas' groupby implementation to make life easier
-    groups_label = [x for x in labels_of_interest if x not in metrics + [run_label]]
-    df_grouped = df.loc[:, labels_of_interest].groupby(groups_label).agg(list)
-    grouped_dict = df_grouped.reset_index().to_dict("records")
+    groups_label = [x for x in config_of_interest if x not in metrics + [run_label]]
+    groups = {}
+    for r in result:
+        group = tuple(r["config"][key] for key in groups_label)
+        groups.setdefault(group, []).append(r["result"])
 
     new_result = []
-
-    for r in grouped_dict:
-        d = {key: r[key] for key in groups_label}
-        d["n_runs"] = len(r[run_label])
+    for group in sorted(groups):
+        runs = groups[group]
+        d = dict(zip(groups_label, group))
+        d["n_runs"] = len(runs)
         for m in metrics:
-            metric_values = np.array([json.loads(f) for f in r[m]])
-            d[f"{m}_avg"] = np.ndarray.mean(metric_values, axis=0)
+            values = stack_runs([r[m] for r in runs], ragged)
+            with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+                warnings.simplefilter("ignore", RuntimeWarning)
+                if ragged == "pad":
+                    n = np.sum(~np.isnan(values), axis=0)
+                    d[f"{m}_avg"] = np.nanmean(values, axis=0)
+                    d[f"{m}_se"] = np.nanstd(values, axis=0, ddof=1) / np.sqrt(n)
+                else:
+                    d[f"{m}_avg"] = np.mean(values, axis=0)
+                    d[f"{m}_se"] = np.std(values, axis=0, ddof=1) / np.sqrt(len(runs))
         new_result.append(d)
     return new_result
 
@@ -83,6 +114,101 @@ def reduce_runs(
     return new_result
 
 
+class RunAggregator:
+    """
+    Computes what reduce_runs computes, but online: results are added one at
+    a time and each group of configurations keeps only its number of runs
+    and the running mean and sum of squared deviations of each metric
+    (Welford's algorithm). The reduced result is available at any time.
+
+    Feed it from a measurement with Ruska.run(..., callback=aggregator.observe),
+    or from a result file with update_from_file. Like reduce_runs, groups are
+    formed by all keys but the metrics and run_label, with values cast to str.
+    """
+
+    def __init__(
+        self,
+        performance_labels=["precision", "recall", "f1"],
+        run_label="run",
+        groups_label: Union[None, List[str]] = None,
+    ):
+        self.performance_labels = list(performance_labels)
+        self.run_label = run_label
+        self.groups_label = groups_label
+        self._groups = {}  # group -> [n, mean, m2]
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, result: dict) -> None:
+        """Add a flat dict of config keys and metrics, as reduce_runs takes them."""
+        if self.groups_label is None:
+            excluded = self.performance_labels + [self.run_label]
+            self.groups_label = [x for x in result.keys() if x not in excluded]
+        group = tuple(str(result[key]) for key in self.groups_label)
+        x = np.array([result[m] for m in self.performance_labels], dtype=np.float64)
+        state = self._groups.get(group)
+        if state is None:
+            self._groups[group] = [1, x, np.zeros_like(x)]
+            return
+        state[0] += 1
+        delta = x - state[1]
+        state[1] = state[1] + delta / state[0]
+        state[2] = state[2] + delta * (x - state[1])
+
+    def observe(self, i: int, config: dict, result) -> None:
+        """
+        Callback for Ruska.run. Takes the metrics from result['result'] if the
+        experiment returns {'config': ..., 'result': {...}}. Skips results
+        that are exceptions, not dicts, or lack one of the metrics, so that a
+        stray result never stops the measurement.
+        """
+        if isinstance(result, dict) and "result" in result:
+            config, result = result.get("config", config), result["result"]
+        if not isinstance(result, dict):
+            return
+        if any(m not in result for m in self.performance_labels):
+            return
+        self.add({**config, **result})
+
+    def update_from_file(self, path: Union[str, Path]) -> None:
+        """
+        Add all results of a measurement. A result table (.db) is streamed row
+        by row, a text result file is read with Ruska.load_result.
+        """
+        from ruska.ruska import Ruska
+
+        path = Path(path)
+        if path.suffix == ".db":
+            with Ruska.load_table(path) as table:
+                for row in table.rows():
+                    if row.get("error") is not None:
+                        continue
+                    flat = {}
+                    for column, value in row.items():
+                        prefix, _, key = column.partition(".")
+                        if prefix in ("config", "result"):
+                            flat[key] = value
+                    self.add(flat)
+        else:
+            results, _ = Ruska.load_result(path)
+            for r in results:
+                self.observe(None, {}, r)
+
+    def result(self) -> List[dict]:
+        """The reduced result in the format of reduce_runs."""
+        new_result = []
+        for group, (n, mean, m2) in self._groups.items():
+            d = dict(zip(self.groups_label, group))
+            d["n_runs"] = n
+            se = np.sqrt(m2 / (n - 1)) / np.sqrt(n) if n > 1 else np.full_like(mean, np.nan)
+            for metric, avg, metric_se in zip(self.performance_labels, mean, se):
+                d[metric + "_avg"] = avg
+                d[metric + "_se"] = metric_se
+            new_result.append(d)
+        return new_result
+
+
 def get_distinct_list(l: list):
     result = []
     for x in l:
@@ -103,7 +229,13 @@ def format_delta(delta: datetime.timedelta):
     return h + m + s
 
 
-def simple_mcar(df: pd.DataFrame, fraction: float, error_token=None):
+def simple_mcar(
+    df: pd.DataFrame,
+    fraction: float,
+    error_token=None,
+    rng: Union[None, np.random.Generator] = None,
+    return_mask: bool = False,
+):
     """
     Randomly insert missing values into a dataframe. Note that specifying the
     error_token as None preserves dtypes in the dataframe. If the error token
@@ -114,6 +246,10 @@ def simple_mcar(df: pd.DataFrame, fraction: float, error_token=None):
     Copies df, so that the clean dataframe you pass doesn't get corrupted
     in place.
 
+    Pass a numpy Generator as rng to make the corruption reproducible. With
+    return_mask=True, a tuple of the dirty dataframe and a boolean dataframe
+    that marks the corrupted cells is returned.
+
     Note that casting to categorical data does mess up the imputer feature
     generator.
     """
@@ -122,19 +258,32 @@ def simple_mcar(df: pd.DataFrame, fraction: float, error_token=None):
 
     if fraction > 1:
         raise ValueError("Cannot turn more than 100% of the values into errors.")
+    rng = np.random.default_rng() if rng is None else rng
     target_corruptions = round(n_rows * n_cols * fraction)
-    error_cells = random.sample(
-        [(x, y) for x in range(n_rows) for y in range(n_cols)],
-        k=target_corruptions,
-    )
 
-    for x, y in error_cells:
-        df_dirty.iat[x, y] = error_token
+    # sample flat cell indices, cell x * n_cols + y is row x in column y
+    error_cells = rng.choice(n_rows * n_cols, size=target_corruptions, replace=False)
+    mask = np.zeros(n_rows * n_cols, dtype=bool)
+    mask[error_cells] = True
+    mask = mask.reshape(n_rows, n_cols)
+
+    for y in range(n_cols):
+        error_rows = np.flatnonzero(mask[:, y])
+        if len(error_rows) > 0:
+            df_dirty.iloc[error_rows, y] = error_token
 
+    if return_mask:
+        return df_dirty, pd.DataFrame(mask, index=df.index, columns=df.columns)
     return df_dirty
 
 
-def simple_mcar_column(se: pd.Series, fraction: float, error_token=None):
+def simple_mcar_column(
+    se: pd.Series,
+    fraction: float,
+    error_token=None,
+    rng: Union[None, np.random.Generator] = None,
+    return_mask: bool = False,
+):
     """
     Randomly insert missing values into a pandas Series. See docs on
     simple_mcar for more information.
@@ -143,10 +292,14 @@ def simple_mcar_column(se: pd.Series, fraction: float, error_token=None):
     in-place and a variable assigned to it is returned.
     """
     n_rows = se.shape[0]
+    rng = np.random.default_rng() if rng is None else rng
     target_corruptions = round(n_rows * fraction)
-    error_positions = random.sample([x for x in range(n_rows)], k=target_corruptions)
-    for x in error_positions:
-        se.iat[x] = error_token
+    error_positions = rng.choice(n_rows, size=target_corruptions, replace=False)
+    se.iloc[error_positions] = error_token
+    if return_mask:
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[error_positions] = True
+        return se, pd.Series(mask, index=se.index, name=se.name)
     return se
 
 
@@ -174,6 +327,8 @@ def send_notification(message: str, chat_id: Union[None, str], token: Union[None
     logger.info(message)
     if chat_id is None or token is None:
         return True
+    import requests
+
     url = f"https://api.telegram.org/bot{token}/sendMessage?chat_id={chat_id}&text={urllib.parse.quote(message)}"
     _ = requests.get(url, timeout=10)
     return True
@@ -1,7 +1,159 @@
+import io
+import itertools
+import collections
 import numpy as np
 import pandas as pd
-import uuid
-from sklearn.metrics import classification_report
+from pathlib import Path
+from multiprocessing import Pool
+from typing import List, Union
+from ruska.errorstore import NestedErrorStore, apply_errors
+
+
+def differences(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Elementwise a != b, where two missing values count as equal. Works on
+    arrays of any shape and dtype, without filling missing values first.
+    """
+    a, b = np.asarray(a), np.asarray(b)
+    different = a != b
+    # NaN != NaN, so only positions that differ can hold two missing values
+    candidates = np.nonzero(different)
+    different[candidates] = ~(pd.isna(a[candidates]) & pd.isna(b[candidates]))
+    return different
+
+
+def confusion_scores(tp, fp, fn, tn) -> pd.DataFrame:
+    """Precision, recall and f1-score from arrays of confusion counts."""
+    tp, fp, fn, tn = (np.asarray(x, dtype=np.int64) for x in (tp, fp, fn, tn))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(tp + fp == 0, 0.0, tp / (tp + fp))
+        r = np.where(tp + fn == 0, 0.0, tp / (tp + fn))
+        f1 = np.where(p + r == 0, 0.0, 2 * p * r / (p + r))
+    return pd.DataFrame(
+        {"tp": tp, "fp": fp, "fn": fn, "tn": tn, "precision": p, "recall": r, "f1": f1}
+    )
+
+
+def count_chunk(
+    df_clean: pd.DataFrame,
+    df_pred: pd.DataFrame,
+    df_dirty: pd.DataFrame,
+    assume_errors_known: bool,
+) -> np.ndarray:
+    """
+    Confusion counts of one row chunk, per column: tp, fp, fn and tn of the
+    cleaning, followed by tp, fp, fn and tn of the error detection.
+    """
+    if not len(df_clean) == len(df_pred) == len(df_dirty):
+        raise ValueError(
+            f"Chunks of {len(df_clean)}, {len(df_pred)} and {len(df_dirty)} "
+            "rows are not aligned."
+        )
+    clean, dirty = df_clean.to_numpy(), df_dirty.to_numpy()
+    pred = df_pred.to_numpy()
+    is_error = differences(clean, dirty)
+    is_wrong = differences(clean, pred)
+    is_detected = differences(dirty, pred)
+    counts = np.zeros((8, clean.shape[1]), dtype=np.int64)
+    counts[0] = (is_error & ~is_wrong).sum(axis=0)
+    counts[2] = (is_error & is_wrong).sum(axis=0)
+    if not assume_errors_known:
+        counts[1] = (~is_error & is_wrong).sum(axis=0)
+        counts[3] = (~is_error & ~is_wrong).sum(axis=0)
+    counts[4] = (is_error & is_detected).sum(axis=0)
+    counts[5] = (~is_error & is_detected).sum(axis=0)
+    counts[6] = (is_error & ~is_detected).sum(axis=0)
+    counts[7] = (~is_error & ~is_detected).sum(axis=0)
+    return counts
+
+
+def read_blocks(path: Union[str, Path], chunksize: int):
+    """
+    Yield the header line followed by the next chunksize lines of a csv file,
+    as raw bytes, for parsing in another process.
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if len(lines) == 0:
+                return
+            yield header + b"".join(lines), len(lines)
+
+
+def _parse_block(block, read_csv_kwargs: dict) -> pd.DataFrame:
+    data, n_lines = block
+    df = pd.read_csv(io.BytesIO(data), **read_csv_kwargs)
+    if len(df) != n_lines:
+        raise ValueError(
+            "Parsed a different number of rows than lines. Counting in "
+            "several processes does not support line breaks inside values."
+        )
+    return df
+
+
+def _count_blocks(clean_block, pred_block, dirty, read_csv_kwargs, assume_errors_known):
+    df_clean = _parse_block(clean_block, read_csv_kwargs)
+    df_pred = _parse_block(pred_block, read_csv_kwargs)
+    if len(dirty) == 3:  # errors of a NestedErrorStore, not a block
+        df_dirty = apply_errors(df_clean, *dirty)
+    else:
+        df_dirty = _parse_block(dirty, read_csv_kwargs)
+    return df_clean.columns, count_chunk(df_clean, df_pred, df_dirty, assume_errors_known)
+
+
+def _aligned_chunks(*readers):
+    for chunks in itertools.zip_longest(*readers):
+        if any(chunk is None for chunk in chunks):
+            raise ValueError("The datasets have different numbers of rows.")
+        yield chunks
+
+
+class GroundTruth:
+    """
+    A clean dataset and the error positions of its dirty version, encoded
+    once. Each column of the clean dataset is factorised into integer codes,
+    missing values included. A prediction is scored by looking up its values
+    in the clean column's uniques, which is a single pass over the
+    prediction: a value is correct if it gets the clean value's code.
+    """
+
+    def __init__(self, df_clean: pd.DataFrame, df_dirty: pd.DataFrame):
+        if df_clean.shape != df_dirty.shape:
+            raise ValueError(
+                f"Cannot compare frames of shapes {df_clean.shape} and {df_dirty.shape}."
+            )
+        self.index = df_clean.index
+        self.columns = df_clean.columns
+        self.shape = df_clean.shape
+        n_rows, n_columns = self.shape
+        # one contiguous row of codes per column
+        self.codes = np.empty((n_columns, n_rows), dtype=np.int32)
+        self.uniques = []
+        for j in range(n_columns):
+            codes, uniques = pd.factorize(df_clean.iloc[:, j])
+            # give missing values a code of their own, the way
+            # use_na_sentinel=False does on pandas >= 1.5
+            missing = codes < 0
+            if missing.any():
+                codes[missing] = len(uniques)
+                uniques = uniques.append(pd.Index([np.nan]))
+            self.codes[j] = codes
+            self.uniques.append(pd.Index(uniques))
+        self.is_error = self.cleaning_errors(df_dirty)
+
+    def encode(self, se: pd.Series, j: int) -> np.ndarray:
+        """Codes of se's values in column j. Values not in the clean column get -1."""
+        return self.uniques[j].get_indexer(se)
+
+    def cleaning_errors(self, df: pd.DataFrame) -> np.ndarray:
+        """Boolean array of shape (columns, rows) selecting values that differ from the clean dataset."""
+        if df.shape != self.shape:
+            raise ValueError(f"Cannot compare frames of shapes {self.shape} and {df.shape}.")
+        is_wrong = np.empty(self.codes.shape, dtype=bool)
+        for j in range(len(self.columns)):
+            np.not_equal(self.encode(df.iloc[:, j], j), self.codes[j], out=is_wrong[j])
+        return is_wrong
 
 
 class Inspector:
@@ -11,13 +163,100 @@ class Inspector:
         self._error_positions = None
         self._predicted_error_positions = None
         self._cleaning_error_positions = None
+        self._ground_truth = None
 
-    def cleaning_report(self):
+    def cleaning_report(
+        self,
+        clean_path: Union[str, Path],
+        pred_path: Union[str, Path],
+        dirty: Union[str, Path, NestedErrorStore],
+        fraction: Union[None, float] = None,
+        chunksize: int = 100_000,
+        workers: Union[None, int] = None,
+        read_csv_kwargs: Union[None, dict] = None,
+    ) -> pd.DataFrame:
         """
         A full report on the cleaning task, inspired by sklearn's
-        classification_report.
+        classification_report: confusion counts, precision, recall and
+        f1-score of the cleaning and of the error detection, per column and
+        overall.
+
+        The datasets are read from csv files in aligned chunks of chunksize
+        rows, so they never need to fit into memory. dirty is either the path
+        of the dirty csv or a NestedErrorStore, whose errors at fraction are
+        applied to each clean chunk. With workers, chunks are counted in that
+        many processes, with at most two chunks per worker in flight.
+
+        By default, the csv files are read the way Corruptor writes them,
+        with an index column and all values as strings.
         """
-        pass
+        read_csv_kwargs = read_csv_kwargs or {"index_col": 0, "dtype": str}
+
+        def read(path):
+            return pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs)
+
+        columns, counts = None, None
+
+        def add(chunk_columns, chunk_counts):
+            nonlocal columns, counts
+            columns = chunk_columns
+            counts = chunk_counts if counts is None else counts + chunk_counts
+
+        if isinstance(dirty, NestedErrorStore) and fraction is None:
+            raise ValueError("Pass the fraction of errors to read from the store.")
+
+        if workers is None or workers <= 1:
+            clean_chunks, pred_chunks = read(clean_path), read(pred_path)
+            if isinstance(dirty, NestedErrorStore):
+                clean_chunks, clean_copy = itertools.tee(clean_chunks)
+                dirty_chunks = dirty.dirty_chunks(fraction, clean_copy)
+            else:
+                dirty_chunks = read(dirty)
+            for df_clean, df_pred, df_dirty in _aligned_chunks(
+                clean_chunks, pred_chunks, dirty_chunks
+            ):
+                add(
+                    df_clean.columns,
+                    count_chunk(df_clean, df_pred, df_dirty, self.assume_errors_known),
+                )
+        else:
+            # Workers parse raw blocks of lines themselves, which is most of
+            # the work and much cheaper to send than DataFrames.
+            clean_blocks = read_blocks(clean_path, chunksize)
+            pred_blocks = read_blocks(pred_path, chunksize)
+            if isinstance(dirty, NestedErrorStore):
+
+                def error_blocks():
+                    for start in range(0, dirty.n_rows, chunksize):
+                        rows, cols, dirty_values = dirty.errors_in_rows(
+                            fraction, start, start + chunksize
+                        )
+                        yield rows - start, cols, dirty_values
+
+                dirty_blocks = error_blocks()
+            else:
+                dirty_blocks = read_blocks(dirty, chunksize)
+            with Pool(workers) as pool:
+                in_flight = collections.deque()
+                for blocks in _aligned_chunks(clean_blocks, pred_blocks, dirty_blocks):
+                    in_flight.append(
+                        pool.apply_async(
+                            _count_blocks,
+                            (*blocks, read_csv_kwargs, self.assume_errors_known),
+                        )
+                    )
+                    if len(in_flight) >= 2 * workers:
+                        add(*in_flight.popleft().get())
+                while len(in_flight) > 0:
+                    add(*in_flight.popleft().get())
+
+        if counts is None:
+            raise ValueError("Cannot report on empty datasets.")
+        counts = np.concatenate([counts, counts.sum(axis=1, keepdims=True)], axis=1)
+        index = [*columns, "overall"]
+        cleaning, detection = confusion_scores(*counts[:4]), confusion_scores(*counts[4:])
+        cleaning.index = detection.index = index
+        return pd.concat([cleaning, detection], axis=1, keys=["cleaning", "detection"])
 
     def compare_series(self, se_a, se_b):
         """
@@ -26,9 +265,8 @@ class Inspector:
         We are careful working with missing values, as NaN == NaN resolves to
         False.
         """
-        # This makes comparison operations work for missing values.
-        fill = str(uuid.uuid4())
-        return se_a.fillna(fill) != se_b.fillna(fill)
+        name = se_a.name if se_a.name == se_b.name else None
+        return pd.Series(differences(se_a, se_b), index=se_a.index, name=name)
 
     def calculate_error_positions(self, y_clean: pd.Series, y_dirty: pd.Series):
         """
@@ -49,22 +287,37 @@ class Inspector:
         df_clean: pd.DataFrame,
         df_pred: pd.DataFrame,
         df_dirty: pd.DataFrame,
-        context_selector,
+        context_selector=slice(None),
         context_height: int = 3,
-    ):
+    ) -> "ErrorContext":
+        """
+        Collect all cleaning errors, i.e. values of df_pred that differ from
+        df_clean, for browsing them with their neighbouring rows. Uses the
+        cleaning error positions of the last evaluation if there is one,
+        otherwise compares the frames. Positions of a single column, from
+        calculate_cleaning_error_positions, limit the errors to that column,
+        or to the rows they select if the series' name is not a column.
 
-        error_indices = self._cleaning_error_positions.index[
-            self._cleaning_error_positions == True
-        ]
-        for i, pos in enumerate(error_indices):
-            row_start, row_end = pos - context_height, pos + context_height
-            print(f"Evaluating error {i} from {len(self._cleaning_error_positions)}")
-            print(f"Error in row {pos}:")
-            print(df_dirty.iloc[row_start:row_end, :].iloc[:, context_selector])
-            print(f"Cleaning result in row {pos}:")
-            print(df_pred.iloc[row_start:row_end, :].iloc[:, context_selector])
-            print(f"Groud truth in row {pos}:")
-            print(df_clean.iloc[row_start:row_end, :].iloc[:, context_selector])
+        context_selector selects the columns shown around each error, by
+        position, and context_height is the number of rows shown above and
+        below it.
+        """
+        positions = self._cleaning_error_positions
+        if isinstance(positions, pd.DataFrame) and positions.shape == df_clean.shape:
+            is_wrong = positions.to_numpy()
+        elif isinstance(positions, pd.Series):
+            selected = positions.reindex(df_clean.index, fill_value=False).to_numpy(bool)
+            if positions.name in df_clean.columns:
+                is_wrong = np.zeros(df_clean.shape, dtype=bool)
+                is_wrong[:, df_clean.columns.get_loc(positions.name)] = selected
+            else:
+                is_wrong = differences(df_clean.to_numpy(), df_pred.to_numpy())
+                is_wrong &= selected[:, np.newaxis]
+        else:
+            is_wrong = differences(df_clean.to_numpy(), df_pred.to_numpy())
+        return ErrorContext(
+            is_wrong, df_clean, df_pred, df_dirty, context_selector, context_height
+        )
 
     def cleaning_performance(
         self, y_clean: pd.Series, y_pred: pd.Series, y_dirty: pd.Series
@@ -103,14 +356,249 @@ class Inspector:
         f1_score = 0.0 if (p + r) == 0 else 2 * (p * r) / (p + r)
         return f1_score
 
+    def cleaning_performance_frame(
+        self, df_clean: pd.DataFrame, df_pred: pd.DataFrame, df_dirty: pd.DataFrame
+    ) -> pd.DataFrame:
+        """
+        Like cleaning_performance, but for all columns of a dataset at once.
+        Returns confusion counts, precision, recall and f1-score per column,
+        and summed over all cells in the last row, called 'overall'.
+
+        The frames are compared by position, so they need the same shape and
+        column order. Two missing values count as equal. Error positions and
+        cleaning error positions are stored as boolean DataFrames.
+        """
+        if not df_clean.shape == df_pred.shape == df_dirty.shape:
+            raise ValueError(
+                f"Cannot compare frames of shapes {df_clean.shape}, "
+                f"{df_pred.shape} and {df_dirty.shape}."
+            )
+        clean = df_clean.to_numpy()
+        is_error = differences(clean, df_dirty.to_numpy())
+        is_wrong = differences(clean, df_pred.to_numpy())
+        self._error_positions = pd.DataFrame(
+            is_error, index=df_clean.index, columns=df_clean.columns, copy=False
+        )
+        self._cleaning_error_positions = pd.DataFrame(
+            is_wrong, index=df_clean.index, columns=df_clean.columns, copy=False
+        )
+        return self._confusion_report(is_error, is_wrong, df_clean.columns, axis=0)
+
+    def encode_ground_truth(
+        self, df_clean: pd.DataFrame, df_dirty: pd.DataFrame
+    ) -> "GroundTruth":
+        """
+        Encode the clean dataset and the error positions of the dirty
+        dataset once, for scoring many predictions with score and
+        score_batch.
+        """
+        self._ground_truth = GroundTruth(df_clean, df_dirty)
+        self._error_positions = pd.DataFrame(
+            self._ground_truth.is_error.T,
+            index=df_clean.index,
+            columns=df_clean.columns,
+            copy=False,
+        )
+        return self._ground_truth
+
+    def score(self, df_pred: pd.DataFrame) -> pd.DataFrame:
+        """
+        Same report as cleaning_performance_frame, against the ground truth
+        passed to encode_ground_truth.
+        """
+        if self._ground_truth is None:
+            raise ValueError("Call encode_ground_truth before scoring predictions.")
+        ground_truth = self._ground_truth
+        is_wrong = ground_truth.cleaning_errors(df_pred)
+        self._cleaning_error_positions = pd.DataFrame(
+            is_wrong.T, index=ground_truth.index, columns=ground_truth.columns, copy=False
+        )
+        return self._confusion_report(
+            ground_truth.is_error, is_wrong, ground_truth.columns, axis=1
+        )
+
+    def score_batch(self, predictions: List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        Score a list of predictions against the encoded ground truth. Returns
+        the reports of all predictions, indexed by (prediction, column).
+        """
+        reports = [self.score(df_pred) for df_pred in predictions]
+        return pd.concat(
+            reports, keys=range(len(reports)), names=["prediction", "column"]
+        )
+
+    def _confusion_report(
+        self, is_error: np.ndarray, is_wrong: np.ndarray, columns, axis: int
+    ) -> pd.DataFrame:
+        """Confusion counts and scores per column, summing cells along axis."""
+        tp = (is_error & ~is_wrong).sum(axis=axis)
+        fn = (is_error & is_wrong).sum(axis=axis)
+        if self.assume_errors_known:
+            fp = tn = np.zeros(len(columns), dtype=np.int64)
+        else:
+            fp = (~is_error & is_wrong).sum(axis=axis)
+            tn = (~is_error & ~is_wrong).sum(axis=axis)
+
+        counts = [np.append(x, x.sum()) for x in (tp, fp, fn, tn)]
+        report = confusion_scores(*counts)
+        report.index = [*columns, "overall"]
+        return report
+
     def error_detection_performance(self, y_pred: pd.Series, y_dirty: pd.Series):
         """
         Calculate the f1-score for finding the correct position of errors in
         y_dirty.
         """
+        from sklearn.metrics import classification_report
+
         self._predicted_error_positions = y_dirty != y_pred
 
         report = classification_report(
             self._error_positions, self._predicted_error_positions
         )
         return report
+
+
+class ErrorContext:
+    """
+    Cleaning errors of a prediction with their context. Each error has a
+    row and column position, the clean, dirty and predicted values, and a
+    type:
+    - 'not cleaned' if the prediction kept an error,
+    - 'wrong repair' if the prediction changed an error to a wrong value,
+    - 'introduced' if the prediction changed a correct value.
+
+    Filtering, paging and sampling return a new ErrorContext with a subset
+    of the errors. The context rows of many errors are gathered at once in
+    to_frame.
+    """
+
+    def __init__(
+        self,
+        is_wrong: np.ndarray,
+        df_clean: pd.DataFrame,
+        df_pred: pd.DataFrame,
+        df_dirty: pd.DataFrame,
+        context_selector=slice(None),
+        context_height: int = 3,
+        errors: Union[None, pd.DataFrame] = None,
+    ):
+        self.frames = {"dirty": df_dirty, "pred": df_pred, "clean": df_clean}
+        self.context_selector = context_selector
+        self.context_height = context_height
+        self._context_columns = np.arange(df_clean.shape[1])[context_selector]
+        if errors is None:
+            errors = self._gather_errors(is_wrong)
+        self.errors = errors
+
+    def _gather_errors(self, is_wrong: np.ndarray) -> pd.DataFrame:
+        rows, cols = np.nonzero(is_wrong)
+        values = {
+            source: df.to_numpy()[rows, cols] for source, df in self.frames.items()
+        }
+        is_error = differences(values["clean"], values["dirty"])
+        is_changed = differences(values["dirty"], values["pred"])
+        error_type = np.where(
+            is_error,
+            np.where(is_changed, "wrong repair", "not cleaned"),
+            "introduced",
+        )
+        df_clean = self.frames["clean"]
+        return pd.DataFrame(
+            {
+                "row": rows,
+                "index": df_clean.index[rows],
+                "column": df_clean.columns[cols],
+                "clean": values["clean"],
+                "dirty": values["dirty"],
+                "pred": values["pred"],
+                "error_type": error_type,
+            }
+        )
+
+    def _subset(self, errors: pd.DataFrame) -> "ErrorContext":
+        return ErrorContext(
+            None,
+            self.frames["clean"],
+            self.frames["pred"],
+            self.frames["dirty"],
+            self.context_selector,
+            self.context_height,
+            errors=errors,
+        )
+
+    def __len__(self):
+        return len(self.errors)
+
+    def __repr__(self):
+        counts = self.errors.groupby("error_type").size().to_dict()
+        return f"ErrorContext({len(self)} errors: {counts})"
+
+    def summary(self) -> pd.DataFrame:
+        """Number of errors per column and error type."""
+        return self.errors.groupby(["column", "error_type"]).size().unstack(fill_value=0)
+
+    def filter(self, column=None, error_type=None, value=None) -> "ErrorContext":
+        """
+        Errors in column, of error_type, or where the clean, dirty or
+        predicted value equals value. Each argument may also be a list.
+        """
+        selected = np.ones(len(self.errors), dtype=bool)
+
+        def is_in(series, x):
+            return series.isin(x if isinstance(x, (list, tuple, set)) else [x]).to_numpy()
+
+        if column is not None:
+            selected &= is_in(self.errors["column"], column)
+        if error_type is not None:
+            selected &= is_in(self.errors["error_type"], error_type)
+        if value is not None:
+            selected &= (
+                is_in(self.errors["clean"], value)
+                | is_in(self.errors["dirty"], value)
+                | is_in(self.errors["pred"], value)
+            )
+        return self._subset(self.errors[selected])
+
+    def page(self, number: int, size: int = 20) -> "ErrorContext":
+        """The errors on page number, counting from 0."""
+        return self._subset(self.errors.iloc[number * size : (number + 1) * size])
+
+    def n_pages(self, size: int = 20) -> int:
+        return -(-len(self) // size)
+
+    def sample(self, n: int, random_state=None) -> "ErrorContext":
+        n = min(n, len(self))
+        return self._subset(self.errors.sample(n, random_state=random_state))
+
+    def to_frame(self, with_context: bool = False) -> pd.DataFrame:
+        """
+        The errors as a table. With context, the table instead has the dirty,
+        predicted and clean values of the selected columns in all rows
+        around each error, indexed by (error, row).
+        """
+        if not with_context:
+            return self.errors
+        n_rows = len(self.frames["clean"])
+        offsets = np.arange(-self.context_height, self.context_height + 1)
+        error_rows = self.errors["row"].to_numpy()
+        rows = error_rows[:, None] + offsets[None, :]
+        valid = (rows >= 0) & (rows < n_rows)
+        error_ids = np.broadcast_to(self.errors.index.to_numpy()[:, None], rows.shape)[valid]
+        rows = rows[valid]
+
+        columns = self._context_columns
+        names = self.frames["clean"].columns[columns]
+        index = pd.MultiIndex.from_arrays([error_ids, rows], names=["error", "row"])
+        parts = [
+            pd.DataFrame(df.iloc[rows, columns].to_numpy(), index=index, columns=names)
+            for df in self.frames.values()
+        ]
+        return pd.concat(parts, axis=1, keys=list(self.frames))
+
+    def context(self, error) -> pd.DataFrame:
+        """The rows around a single error, by its label in self.errors."""
+        return self._subset(self.errors.loc[[error]]).to_frame(with_context=True).loc[error]
+
+    def to_html(self, with_context: bool = False, **kwargs) -> str:
+        return self.to_frame(with_context).to_html(**kwargs)
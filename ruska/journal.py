@@ -0,0 +1,78 @@
+import os
+import json
+import pickle
+import logging
+from pathlib import Path
+from typing import Dict, Union
+
+
+class Journal:
+    """
+    An append-only log of finished measurements. Ruska.run appends one record
+    per configuration as soon as that configuration is measured, so that a
+    measurement that crashed after 40 hours can be resumed instead of
+    started from scratch.
+
+    Records are pickled one after another into the same file. Results need to
+    be picklable anyway to travel back from Pool workers.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    @staticmethod
+    def key(config: dict) -> str:
+        """
+        Identify a configuration independently of its position in the grid,
+        so that a resumed measurement may use extended ranges.
+        """
+        return json.dumps(config, sort_keys=True, default=str)
+
+    def reset(self) -> None:
+        """Start a fresh journal, discarding records of earlier measurements."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        open(self.path, "wb").close()
+
+    def append(self, index: int, config: dict, result, stats: Union[None, dict] = None) -> None:
+        """
+        Append a record and flush it to disk before returning. stats are the
+        resources the measurement used, see ruska.executor.run_experiment.
+        """
+        record = {"index": index, "config": config, "result": result, "stats": stats}
+        try:
+            data = pickle.dumps(record)
+        except Exception as e:
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                f"Cannot journal the result of configuration {index}, it will "
+                f"be measured again when resuming: {e!r}"
+            )
+            return
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self) -> Dict[str, dict]:
+        """
+        Read all complete records and return them keyed by Journal.key(config).
+        A record that was only partially written when the measurement died is
+        cut off the end of the file, so that new records can be appended.
+        """
+        records = {}
+        if not self.path.exists():
+            return records
+
+        with open(self.path, "r+b") as f:
+            valid_until = 0
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:  # truncated record
+                    break
+                valid_until = f.tell()
+                records[self.key(record["config"])] = record
+            f.truncate(valid_until)
+        return records
@@ -0,0 +1,109 @@
+import time
+import queue
+import logging
+import threading
+from typing import List, Tuple, Union
+
+# Telegram rejects messages longer than this.
+MAX_MESSAGE_LENGTH = 4096
+
+
+class NotificationDispatcher:
+    """
+    Sends notifications through the telegram bot @ruska_experiment_bot from a
+    background thread, so that a slow API never stalls a measurement.
+
+    Messages that arrive within min_interval seconds of the last request are
+    coalesced into a single message. All requests share a pooled connection.
+    Messages that are still queued when the dispatcher is closed are
+    delivered before close returns.
+    """
+
+    _stop = object()
+
+    def __init__(
+        self,
+        chat_id: Union[None, str],
+        token: Union[None, str],
+        min_interval: float = 1.0,
+        base_url: str = "https://api.telegram.org",
+    ):
+        self.chat_id = chat_id
+        self.token = token
+        self.min_interval = min_interval
+        self.base_url = base_url
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.chat_id is not None and self.token is not None
+
+    def send(self, message: str) -> None:
+        """Queue a message and return immediately."""
+        logger = logging.getLogger(__name__)
+        logger.info(message)
+        if not self.enabled:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(message)
+
+    def close(self, timeout: Union[None, float] = 30.0) -> None:
+        """Deliver all queued messages and stop the background thread."""
+        if self._thread is None:
+            return
+        self._queue.put(self._stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _collect(self, deadline: float) -> Tuple[List[str], bool]:
+        """Collect messages until deadline, or until asked to stop."""
+        messages = []
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                return messages, False
+            if message is self._stop:
+                return messages, True
+            messages.append(message)
+
+    def _run(self):
+        import requests
+
+        logger = logging.getLogger(__name__)
+        url = f"{self.base_url}/bot{self.token}/sendMessage"
+        last_request = float("-inf")
+        stopping = False
+        with requests.Session() as session:
+            while not stopping:
+                message = self._queue.get()
+                if message is self._stop:
+                    break
+                more, stopping = self._collect(last_request + self.min_interval)
+                messages = [message] + more
+                for text in self._split("\n".join(messages)):
+                    last_request = time.monotonic()
+                    try:
+                        response = session.get(
+                            url, params={"chat_id": self.chat_id, "text": text}, timeout=10
+                        )
+                        response.raise_for_status()
+                    except Exception as e:
+                        logger.warning(f"Could not send a notification: {e!r}")
+
+    @staticmethod
+    def _split(text: str) -> List[str]:
+        return [
+            text[i : i + MAX_MESSAGE_LENGTH]
+            for i in range(0, len(text), MAX_MESSAGE_LENGTH)
+        ]
@@ -1,11 +1,149 @@
+import os
 import math
+import collections
 import itertools
 import functools
-from .helpers import reduce_runs, get_distinct_list
+from pathlib import Path
+from multiprocessing import Pool
+from typing import Callable, List, Tuple, Union
+from .helpers import RunAggregator, get_distinct_list
 from matplotlib import pyplot as plt
 import numpy as np
 
 
+class ReducedResult:
+    """
+    Results reduced over runs once, as reduce_runs does, and indexed by the
+    values of the plotted dimensions. Pass it to the plot functions instead
+    of raw results to plot the same measurement many times without reducing
+    it again. Like reduce_runs, config values are strings.
+    """
+
+    def __init__(
+        self,
+        formatted_result: List[dict],
+        performance_labels=["precision", "recall", "f1"],
+        run_label: str = "run",
+    ):
+        aggregator = RunAggregator(performance_labels, run_label)
+        for r in formatted_result:
+            aggregator.add(r)
+        self.rows = aggregator.result()
+        self._indices = {}
+
+    @classmethod
+    def from_ruska_result(cls, ruska_result: list, **kwargs) -> "ReducedResult":
+        """Reduce results as Ruska.load_result returns them."""
+        return cls([{**x["config"], **x["result"]} for x in ruska_result], **kwargs)
+
+    @classmethod
+    def from_file(
+        cls, path: Union[str, Path], performance_labels=("precision", "recall", "f1"), run_label="run"
+    ) -> "ReducedResult":
+        """
+        Reduce a result file. Reductions are cached until the file changes,
+        so every figure of a report can call this.
+        """
+        path = Path(path).resolve()
+        return _reduce_file(path, path.stat().st_mtime, tuple(performance_labels), run_label)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def select(self, **values) -> List[dict]:
+        """Reduced rows whose config matches values, e.g. select(dataset='hospital')."""
+        keys = tuple(sorted(values))
+        index = self._indices.get(keys)
+        if index is None:
+            index = {}
+            for row in self.rows:
+                index.setdefault(tuple(row[k] for k in keys), []).append(row)
+            self._indices[keys] = index
+        return index.get(tuple(str(values[k]) for k in keys), [])
+
+    def select_one(self, **values) -> dict:
+        """
+        The reduced row whose config matches values. Combinations that were
+        not measured, e.g. because of a constraint, get NaN scores.
+        """
+        rows = self.select(**values)
+        if len(rows) > 0:
+            return rows[0]
+        return collections.defaultdict(lambda: float("nan"), values)
+
+    def distinct(self, key: str) -> list:
+        return get_distinct_list(row[key] for row in self.rows)
+
+
+@functools.lru_cache(maxsize=32)
+def _reduce_file(path: Path, mtime: float, performance_labels: tuple, run_label: str):
+    from .ruska import Ruska
+
+    results, _ = Ruska.load_result(path)
+    results = [r for r in results if not isinstance(r, Exception)]
+    return ReducedResult.from_ruska_result(
+        results, performance_labels=list(performance_labels), run_label=run_label
+    )
+
+
+def _reduced(ruska_result, run_label="run") -> ReducedResult:
+    if isinstance(ruska_result, ReducedResult):
+        return ruska_result
+    return ReducedResult.from_ruska_result(ruska_result, run_label=run_label)
+
+
+# The figures rendered by the workers of render_figures.
+_figures = []
+
+
+def _init_render_worker(figures):
+    global _figures
+    _figures = figures
+    plt.switch_backend("Agg")
+
+
+def _render_figure(k: int, savefig_kwargs: dict) -> str:
+    path, plot, kwargs = _figures[k]
+    fig = plot(**kwargs)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(path, **savefig_kwargs)
+    plt.close(fig)
+    return str(path)
+
+
+def render_figures(
+    figures: List[Tuple[Union[str, Path], Callable, dict]],
+    workers: Union[None, int] = None,
+    savefig_kwargs: Union[None, dict] = None,
+) -> List[str]:
+    """
+    Render a list of figures straight to files, each given as a tuple of
+    (path, plot function, keyword arguments), e.g.
+    ('report/hospital.pdf', plot_bars, {'formatted_result': reduced, ...}).
+
+    Figures are rendered in workers processes with matplotlib's
+    non-interactive Agg backend. The figure list is handed to each worker
+    once, so pass the same ReducedResult to many figures rather than raw
+    results. With a single worker, figures are rendered in this process
+    with its current backend, which leaves open figures, e.g. those of a
+    notebook, alone. Returns the paths of the written files.
+    """
+    global _figures
+    savefig_kwargs = savefig_kwargs or {}
+    workers = workers or os.cpu_count()
+    if workers <= 1:
+        # switch_backend would close all open figures of this process
+        _figures = figures
+        try:
+            return [_render_figure(k, savefig_kwargs) for k in range(len(figures))]
+        finally:
+            _figures = []
+    with Pool(workers, initializer=_init_render_worker, initargs=(figures,)) as pool:
+        return pool.starmap(
+            _render_figure, [(k, savefig_kwargs) for k in range(len(figures))]
+        )
+
+
 def prepare_result_v1(ruska_result: tuple):
     """
     Transform what is returned by Ruska.load_result() into a format that is
@@ -34,8 +172,12 @@ def plot_bars(formatted_result,
     contains as many plots as the result contains datasets. One parameter
     can then be plotted on the x-axis,  while the y-axis displays one of the
     three classification scores.
+    formatted_result may also be a ReducedResult of the prepared results.
     """
-    r = reduce_runs(formatted_result, run_label=run_label)
+    if isinstance(formatted_result, ReducedResult):
+        r = formatted_result
+    else:
+        r = ReducedResult(formatted_result, run_label=run_label)
     dimension_ranges = [ruska_config['ranges'][k] for k in ax_keys]
     dimensions = list(itertools.product(*dimension_ranges))
     n_rows = math.ceil(len(dimensions)/2)
@@ -47,10 +189,7 @@ def plot_bars(formatted_result,
     axs = np.ravel(axs)
     rects = []
     for i, d in enumerate(dimensions):
-        def fltr(x):
-            check = [x[key] == str(v) for key, v in zip(ax_keys, d)]
-            return all(check)
-        subset = list(filter(fltr, r))
+        subset = r.select(**dict(zip(ax_keys, d)))
         y = [round(x[f'{score}_avg'], 2) for x in subset]
         x = [str(x[parameter]) for x in subset]
         rect = axs[i].bar(x, y, color=f'C{i}')
@@ -73,21 +212,19 @@ def jenga_plot(*, ruska_result_pdep, ruska_result_naive, ruska_config):
     A bar plot, comparing cleaning f1-scores between pdep and naive vicinity
     model, grouped by error rate.
     Creates an axis per error-sampling method in the ruska_config.
+    Both results may also be passed as ReducedResult.
     """
-    result_pdep = [{**x["config"], **x["result"]} for x in ruska_result_pdep]
-    result_naive = [{**x["config"], **x["result"]} for x in ruska_result_naive]
-
-    r_pdep = reduce_runs(result_pdep, run_label="run")
-    r_naive = reduce_runs(result_naive, run_label="run")
+    r_pdep = _reduced(ruska_result_pdep, run_label="run")
+    r_naive = _reduced(ruska_result_naive, run_label="run")
 
-    samplings = get_distinct_list(x["sampling"] for x in result_pdep)
-    error_fractions = get_distinct_list(x["error_fraction"] for x in result_pdep)
+    samplings = r_pdep.distinct("sampling")
+    error_fractions = r_pdep.distinct("error_fraction")
     fig, axs = plt.subplots(len(samplings), 1, figsize=(14, 8))
     axs = np.ravel(axs)
     for i, sampling in enumerate(samplings):
 
-        pdep = [x for x in r_pdep if (x["sampling"] == sampling)]
-        naive = [x for x in r_naive if (x["sampling"] == sampling)]
+        pdep = [r_pdep.select_one(sampling=sampling, error_fraction=e) for e in error_fractions]
+        naive = [r_naive.select_one(sampling=sampling, error_fraction=e) for e in error_fractions]
 
         x = np.arange(len(error_fractions))
         width = 0.3
@@ -137,22 +274,19 @@ def jenga_plot_datasets(*, ruska_result_pdep, ruska_result_naive, ruska_config):
     A bar plot, comparing cleaning f1-scores between pdep and naive vicinity
     model, grouped by error rate.
     Creates an axis per dataset in the ruska_config. Assumes a static
-    error-sampling-method.
+    error-sampling-method. Both results may also be passed as ReducedResult.
     """
-    result_pdep = [{**x["config"], **x["result"]} for x in ruska_result_pdep]
-    result_naive = [{**x["config"], **x["result"]} for x in ruska_result_naive]
-
-    r_pdep = reduce_runs(result_pdep, run_label="run")
-    r_naive = reduce_runs(result_naive, run_label="run")
+    r_pdep = _reduced(ruska_result_pdep, run_label="run")
+    r_naive = _reduced(ruska_result_naive, run_label="run")
 
-    datasets = get_distinct_list(x["dataset"] for x in result_pdep)
-    error_fractions = get_distinct_list(x["error_fraction"] for x in result_pdep)
+    datasets = r_pdep.distinct("dataset")
+    error_fractions = r_pdep.distinct("error_fraction")
     fig, axs = plt.subplots(len(datasets), 1, figsize=(14, 8))
     axs = np.ravel(axs)
     for i, dataset in enumerate(datasets):
 
-        pdep = [x for x in r_pdep if (x["dataset"] == dataset)]
-        naive = [x for x in r_naive if (x["dataset"] == dataset)]
+        pdep = [r_pdep.select_one(dataset=dataset, error_fraction=e) for e in error_fractions]
+        naive = [r_naive.select_one(dataset=dataset, error_fraction=e) for e in error_fractions]
 
         x = np.arange(len(error_fractions))
         width = 0.3
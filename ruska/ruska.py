@@ -1,15 +1,37 @@
 import os
-import json
+import math
 import logging
+import collections
 import datetime
-import itertools
-from multiprocessing import Pool
-from pathlib import Path, PosixPath
 from pprint import pprint
-from pathlib import Path
-from typing import Dict, List, Callable, Union
+from pathlib import Path, PosixPath, WindowsPath
+from typing import Dict, List, Callable, Tuple, Union
 
-from ruska.helpers import send_notification, estimate_time_to_finish
+from ruska.notifications import NotificationDispatcher
+from ruska.journal import Journal
+from ruska.cache import ResultCache
+from ruska.storage import ResultTable, write_result_table
+from ruska.scheduler import RuntimeHistory
+from ruska.datasets import load_datasets, publish_datasets
+from ruska.grid import ParameterGrid, Constraint
+from ruska.executor import (
+    run_parallel,
+    run_sequential,
+    ExperimentFailure,
+    ExperimentTimeout,
+    MemoryLimitExceeded,
+    WorkerLost,
+)
+
+# Names that the reprs in a result file refer to, for load_result's eval.
+_result_file_names = {
+    "PosixPath": PosixPath,
+    "WindowsPath": WindowsPath,
+    "ExperimentFailure": ExperimentFailure,
+    "ExperimentTimeout": ExperimentTimeout,
+    "MemoryLimitExceeded": MemoryLimitExceeded,
+    "WorkerLost": WorkerLost,
+}
 
 
 class Ruska:
@@ -38,23 +60,58 @@ class Ruska:
         chat_id: Union[None, str] = None,
         token: Union[None, str] = None,
         is_logging: bool = True,
+        cache_path: Union[None, str] = None,
+        cache_size: int = 2**30,
+        fingerprint: Union[None, str] = None,
+        runtime_history: Union[None, str] = None,
+        datasets: Union[None, Dict[str, Union[str, dict]]] = None,
+        constraints: Union[None, List[Union[Constraint, Callable]]] = None,
     ):
-        """Pass all parameters for raha as kwargs."""
+        """
+        Pass all parameters for raha as kwargs.
+
+        When cache_path is set, results are stored in a ResultCache at that
+        path, keyed by the merged config, commit and fingerprint. Configurations
+        already in the cache are not measured again. Use the fingerprint to
+        tell apart results that depend on something else than config and
+        commit, e.g. the version of a dataset.
+
+        When runtime_history is set, the duration of each configuration is
+        recorded in a RuntimeHistory at that path, which may be shared between
+        measurements. run(longest_first=True) uses it to measure the
+        configurations that are expected to take longest first.
+
+        datasets maps names to csv files, see ruska.datasets.load_datasets.
+        Ruska reads each of them once before the measurement starts, and
+        experiments get them by calling ruska.get_dataset(name) instead of
+        reading the csv files for every configuration in every worker.
+
+        constraints are predicates or Constraints, see ruska.grid, that exclude
+        combinations of ranges from the measurement before they are built.
+        """
         self.name = name
         self.description = description
         self.commit = commit
         self.config = config
         self.ranges = {**ranges, "run": list(range(runs))}
         self.save_path = Path(save_path) / f"{name}.txt"
+        self.journal_path = self.save_path.with_suffix(".journal")
+        self.table_path = self.save_path.with_suffix(".db")
+        self.profile_path = self.save_path.with_suffix(".profiles")
         self.chat_id = chat_id
         self.token = token
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.fingerprint = fingerprint
+        self.runtime_history = runtime_history
+        self.datasets = datasets
         self.times = []
 
         for range_key in ranges:
             if range_key not in config.keys():
                 raise ValueError("Ranges müssen im Config dict enthalten sein.")
 
-        self.range_combinations: List[dict] = []
+        self.grid = ParameterGrid(self.ranges, constraints)
 
         if is_logging:
             self.logging_path = os.path.splitext(self.save_path)[0] + ".log"
@@ -69,58 +126,232 @@ class Ruska:
     def end_time(self):
         return self.times[-1]
 
-    def _combine_ranges(self) -> None:
-        """
-        Calculate all possible combinations of ranges. Assigns them to
-        self.range_combinations.
-        @return: None
+    def run(
+        self,
+        experiment: Callable,
+        parallel=False,
+        workers=None,
+        resume=False,
+        chunksize: int = 1,
+        timeout: Union[None, float] = None,
+        max_rss: Union[None, int] = None,
+        maxtasksperchild: Union[None, int] = None,
+        longest_first: bool = False,
+        coordinator: Union[None, Tuple[str, int]] = None,
+        authkey: Union[None, bytes] = None,
+        lease_timeout: float = 60.0,
+        notify_every: Union[None, int] = None,
+        callback: Union[None, Callable] = None,
+        profile: Union[None, bool, Callable[[dict], bool]] = None,
+    ):
         """
-        value_combinations = itertools.product(*list(self.ranges.values()))
-        for combination in value_combinations:
-            range_combinations = {}
-            for i, key_range in enumerate(self.ranges.keys()):
-                range_combinations[key_range] = combination[i]
-            self.range_combinations.append(range_combinations)
+        Measure the experiment for every combination of ranges.
 
-    def run(self, experiment: Callable, parallel=False, workers=None):
-        self._combine_ranges()
+        With parallel=True, configurations are measured on a Pool of workers
+        and handed to the Pool in chunks of chunksize. Results are collected
+        as soon as they finish and put back in the order of the grid. In both
+        modes, an experiment raising an exception does not stop the
+        measurement: the exception becomes the result of that configuration.
+
+        A configuration that runs longer than timeout seconds, or whose process
+        uses more than max_rss bytes of memory, is stopped and recorded as an
+        ExperimentTimeout or MemoryLimitExceeded. Should a worker die, the
+        configuration it measured is recorded as WorkerLost. In parallel mode,
+        workers are replaced after measuring maxtasksperchild configurations,
+        rounded down to whole chunks of chunksize.
+
+        With longest_first=True, configurations are dispatched in the order of
+        their predicted duration, longest first, which keeps all workers busy
+        until the end of the measurement. Results are stored in the order of
+        the grid regardless.
+
+        With coordinator=(host, port), configurations are not measured by this
+        process, but served to workers on any number of machines, see
+        ruska.distributed. Workers started with
+        `python -m ruska.distributed host:port module:experiment` lease
+        configurations and must send a heartbeat every lease_timeout seconds.
+        Coordinator and workers share the authkey, or the environment
+        variable RUSKA_AUTHKEY.
+
+        With notify_every=n, a progress notification is sent after every n
+        measured configurations. Notifications are sent from a background
+        thread and never hold up the measurement.
+
+        callback(i, config, result) is called with each result as soon as it
+        is known, including results that are resumed or found in the cache,
+        e.g. with RunAggregator.observe to summarise a running measurement.
+
+        The journal and the result table record the resources each
+        configuration used: wall_time and cpu_time in seconds, peak_rss in
+        bytes and the worker that measured it. peak_rss_lifetime is True
+        where peak_rss is the peak of the whole worker process, see
+        run_experiment. With profile=True, or a
+        function that returns True for the configs to profile, experiments
+        run under cProfile and their profiles are stored as
+        self.profile_path/<index>.prof, to be read with pstats.Stats. With a
+        coordinator, profile must be picklable.
+
+        Each finished configuration is appended to the journal at
+        self.journal_path right away. With resume=True, configurations that
+        the journal holds a result for are not measured again. Configurations
+        that raised an exception are measured again.
+        """
+        # imported here, so that importing Ruska doesn't load pandas
+        from ruska.helpers import estimate_time_to_finish
 
-        # overwrite config with range when specified
-        configs = [
-            {**self.config, **range_config} for range_config in self.range_combinations
-        ]
         logger = logging.getLogger(__name__)
-        logger.debug(f'Generated configs \n {json.dumps(configs, indent=2)}')
+        logger.debug(f"Measuring a grid of {len(self.grid)} combinations of ranges.")
 
-        self.times.append(datetime.datetime.now())
+        journal = Journal(self.journal_path)
+        measured = journal.load() if resume else {}
+        if not resume:
+            journal.reset()
+        cache = None
+        if self.cache_path is not None:
+            cache = ResultCache(self.cache_path, self.cache_size)
 
-        send_notification(
-            f"Ruska starts an experiment called {self.name}.", self.chat_id, self.token
+        results = {}
+        stats = {}
+        if resume or cache is not None:
+            n_configs = 0
+            n_resumed = 0
+            missing = object()
+            for i, range_config in self.grid.indexed():
+                n_configs += 1
+                config = {**self.config, **range_config}
+                record = measured.get(Journal.key(config))
+                if record is not None and not isinstance(record["result"], Exception):
+                    results[i] = record["result"]
+                    stats[i] = record.get("stats")
+                    n_resumed += 1
+                elif cache is not None:
+                    key = ResultCache.key(config, self.commit, self.fingerprint)
+                    result = cache.get(key, missing)
+                    if result is not missing:
+                        results[i] = result
+                        journal.append(i, config, result)
+            if resume:
+                logger.info(
+                    f"Resuming {self.name}: {n_resumed} of {n_configs} "
+                    f"configurations were already measured."
+                )
+            if cache is not None:
+                logger.info(
+                    f"Found {len(results) - n_resumed} of {n_configs - n_resumed} "
+                    f"configurations in the cache at {self.cache_path}."
+                )
+        else:
+            n_configs = self.grid.count()
+        del measured
+        skipped = set(results)
+        if callback is not None:
+            for i in sorted(skipped):
+                callback(i, {**self.config, **self.grid[i]}, results[i])
+        n_pending = n_configs - len(skipped)
+        # overwrite config with range when specified
+        pending = (
+            (i, {**self.config, **range_config})
+            for i, range_config in self.grid.indexed()
+            if i not in skipped
         )
 
-        results = []
-        if parallel:
-            pool = Pool(workers)
-            results = pool.starmap(experiment, enumerate(configs))
-            pool.close()
-            self.times.append(datetime.datetime.now())
+        history = None
+        if self.runtime_history is not None:
+            history = RuntimeHistory(self.runtime_history)
+            if longest_first:
+                keys = [k for k in self.ranges if k != "run"]
+                pending = history.longest_first(list(pending), keys)
+        elif longest_first:
+            logger.warning("Cannot schedule longest_first without runtime_history.")
+
+        def record(i: int, config: dict, result, result_stats: Union[None, dict]):
+            if result_stats is not None and "profile" in result_stats:
+                self.profile_path.mkdir(parents=True, exist_ok=True)
+                path = self.profile_path / f"{i}.prof"
+                path.write_bytes(result_stats["profile"])
+                result_stats["profile"] = str(path)
+            stats[i] = result_stats
+            journal.append(i, config, result, result_stats)
+            if history is not None and result_stats is not None:
+                history.record(config, result_stats["wall_time"])
+            if cache is not None and not isinstance(result, Exception):
+                key = ResultCache.key(config, self.commit, self.fingerprint)
+                cache.put(key, self.commit, result)
+
+        # Progress counts the configurations of this call only, run_adaptive
+        # and run_halving call run repeatedly.
+        run_times = [datetime.datetime.now()]
+        self.times.append(run_times[0])
+
+        notifications = NotificationDispatcher(self.chat_id, self.token)
+        notifications.send(f"Ruska starts an experiment called {self.name}.")
+
+        # Datasets are loaded by whoever measures: this process, or each
+        # worker of a coordinator.
+        frames = None
+        if self.datasets is not None and coordinator is None:
+            frames = load_datasets(self.datasets)
+            publish_datasets(frames)
+
+        if coordinator is not None:
+            # imported here, so that `python -m ruska.distributed` finds it unimported
+            from ruska.distributed import run_distributed
+
+            measurements = run_distributed(
+                pending,
+                coordinator,
+                authkey,
+                lease_timeout,
+                {
+                    "datasets": self.datasets,
+                    "timeout": timeout,
+                    "max_rss": max_rss,
+                    "profile": profile,
+                },
+            )
+        elif parallel:
+            measurements = run_parallel(
+                experiment,
+                pending,
+                workers,
+                chunksize,
+                timeout,
+                max_rss,
+                maxtasksperchild,
+                frames,
+                profile,
+            )
         else:
-            for i, config in enumerate(configs):
-                try:
-                    result = experiment(i, config)
-                except Exception as e:
-                    result = e
-                results.append(result)
-                self.times.append(datetime.datetime.now())
-                print(estimate_time_to_finish(self.times, len(self.range_combinations)))
+            measurements = run_sequential(experiment, pending, timeout, max_rss, profile)
+
+        for i, result, result_stats in measurements:
+            results[i] = result
+            config = {**self.config, **self.grid[i]}
+            record(i, config, result, result_stats)
+            if callback is not None:
+                callback(i, config, result)
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Configuration {i} raised {result!r}:\n"
+                    f"{getattr(result, 'ruska_traceback', '')}"
+                )
+            run_times.append(datetime.datetime.now())
+            self.times.append(run_times[-1])
+            progress = estimate_time_to_finish(run_times, n_pending)
+            print(progress)
+            n_finished = len(run_times) - 1
+            if notify_every is not None and n_finished % notify_every == 0:
+                notifications.send(f"{self.name}: {progress}")
 
-        logger.info(f'Finished {len(configs)} measurements.')
+        logger.info(f'Finished {n_configs} measurements.')
 
         config_store = {
             k: v
             for k, v in vars(self).items()
-            if k not in ["range_combinations", "token", "chat_id"]
+            if k not in ["grid", "token", "chat_id"]
         }
+        indices = sorted(results)
+        results = [results[i] for i in indices]
 
         with open(self.save_path, "w") as f:
             print("Experiment using Ruska finished.", file=f)
@@ -133,26 +364,233 @@ class Ruska:
             print("[BEGIN RESULTS]", file=f)
             pprint(results, f)
             print("[END RESULTS]", file=f)
+        configs = ({**self.config, **self.grid[i]} for i in indices)
+        try:
+            write_result_table(
+                self.table_path, config_store, configs, results, [stats.get(i) for i in indices]
+            )
+        except Exception as e:
+            logger.warning(f"Could not write the result table {self.table_path}: {e!r}")
         print("Measurement finished")
-        send_notification(
+        notifications.send(
             f"Measurements of experiment {self.name} finished.\n"
-            f"Results are stored at {self.save_path}.",
-            self.chat_id,
-            self.token,
+            f"Results are stored at {self.save_path}."
         )
+        notifications.close()
         logger.info(f'Wrote results to {self.save_path}. Stopping.')
 
+    def run_adaptive(
+        self,
+        experiment: Callable,
+        metric: str,
+        max_se: float,
+        min_runs: int = 3,
+        **run_kwargs,
+    ):
+        """
+        Measure each configuration as often as it takes to pin down metric,
+        instead of a fixed number of runs. All configurations are measured
+        min_runs times first. After that, further runs are measured in waves,
+        one more run per wave for each configuration whose standard error of
+        metric, computed as in reduce_runs, is still above max_se. The runs
+        passed to Ruska are the maximum number of runs of a configuration.
+
+        Each wave is a call of run with the remaining runs, which resumes
+        from the journal, so the result file always holds all runs measured
+        so far in the usual format. metric is read from result['result'] if
+        the experiment returns {'config': ..., 'result': {...}}, otherwise
+        from the result. run_kwargs are passed on to run.
+
+        Returns a dict per combination of the ranges but run, with its
+        n_runs and the average and standard error of metric.
+        """
+        from ruska.helpers import RunAggregator
+
+        logger = logging.getLogger(__name__)
+        max_runs = len(self.ranges["run"])
+        keys = [k for k in self.ranges if k != "run"]
+        user_callback = run_kwargs.pop("callback", None)
+        resume = run_kwargs.pop("resume", False)
+        allowed_runs = collections.defaultdict(lambda: min(min_runs, max_runs))
+
+        constraint = Constraint(
+            lambda c: c["run"] < allowed_runs[self._group(keys, c)], [*keys, "run"]
+        )
+        self.grid.constrain(constraint)
+        try:
+            wave = 0
+            while True:
+                aggregator = RunAggregator([metric], groups_label=keys)
+
+                self.run(
+                    experiment,
+                    resume=resume or wave > 0,
+                    callback=self._observer(metric, aggregator, user_callback),
+                    **run_kwargs,
+                )
+                n_converged, n_growing = 0, 0
+                for r in aggregator.result():
+                    g = self._group(keys, r)
+                    converged = r["n_runs"] > 1 and r[f"{metric}_se"] <= max_se
+                    if converged or allowed_runs[g] >= max_runs:
+                        n_converged += converged
+                        continue
+                    allowed_runs[g] += 1
+                    n_growing += 1
+                wave += 1
+                logger.info(
+                    f"Wave {wave}: {n_converged} configurations have a standard "
+                    f"error of {metric} <= {max_se}, {n_growing} get another run."
+                )
+                if n_growing == 0:
+                    break
+        finally:
+            self.grid.constraints.remove(constraint)
+        return [
+            {
+                **self._combination(keys, self._group(keys, r)),
+                "n_runs": r["n_runs"],
+                f"{metric}_avg": float(r[f"{metric}_avg"]),
+                f"{metric}_se": float(r[f"{metric}_se"]),
+            }
+            for r in aggregator.result()
+        ]
+
+    def run_halving(
+        self,
+        experiment: Callable,
+        metric: str,
+        budget_key: str,
+        keep: float = 1 / 3,
+        maximize: bool = True,
+        **run_kwargs,
+    ) -> List[dict]:
+        """
+        Successive halving over the ranges. budget_key is a range whose values
+        are budgets in increasing order, e.g. the fraction of rows an
+        experiment reads or its number of epochs. All combinations are
+        measured at the smallest budget first. Of these, the keep fraction
+        with the best average metric over runs is measured at the next
+        budget, and so on until the largest budget.
+
+        Each rung is a call of run restricted to the surviving combinations,
+        which resumes from the journal, so the result file holds all rungs in
+        the usual format with the budget in each config. The rungs, with the
+        combinations that advanced from each, are returned and also written
+        to the config section of the result file, as rungs. metric is read as
+        in run_adaptive, run_kwargs are passed on to run.
+        """
+        from ruska.helpers import RunAggregator
+
+        if budget_key not in self.ranges:
+            raise ValueError(
+                f"Pass the budgets as a range, e.g. ranges={{'{budget_key}': [0.1, 0.3, 1.0]}}."
+            )
+        logger = logging.getLogger(__name__)
+        budgets = self.ranges[budget_key]
+        keys = [k for k in self.ranges if k not in ["run", budget_key]]
+        user_callback = run_kwargs.pop("callback", None)
+        resume = run_kwargs.pop("resume", False)
+        rung_of = {}  # combination -> highest rung it may be measured at
+
+        constraint = Constraint(
+            lambda c: budgets.index(c[budget_key]) <= rung_of.get(self._group(keys, c), 0),
+            [*keys, budget_key],
+        )
+        self.grid.constrain(constraint)
+        # an attribute, so that run writes the rungs to the result file
+        self.rungs = rungs = []
+        try:
+            for rung, budget in enumerate(budgets):
+                aggregator = RunAggregator([metric], groups_label=[*keys, budget_key])
+
+                self.run(
+                    experiment,
+                    resume=resume or rung > 0,
+                    callback=self._observer(metric, aggregator, user_callback),
+                    **run_kwargs,
+                )
+                scores = {
+                    self._group(keys, r): r[f"{metric}_avg"]
+                    for r in aggregator.result()
+                    if r[budget_key] == str(budget)
+                }
+                ranked = sorted(scores, key=scores.get, reverse=maximize)
+                n_keep = 0 if rung == len(budgets) - 1 else max(1, math.ceil(len(ranked) * keep))
+                for g in ranked[:n_keep]:
+                    rung_of[g] = rung + 1
+                rungs.append(
+                    {
+                        "budget": budget,
+                        "measured": len(scores),
+                        "advanced": [self._combination(keys, g) for g in ranked[:n_keep]],
+                        "best": self._combination(keys, ranked[0]) if len(ranked) > 0 else None,
+                        f"best_{metric}": float(scores[ranked[0]]) if len(ranked) > 0 else None,
+                    }
+                )
+                logger.info(
+                    f"Rung {rung} at {budget_key}={budget}: measured {len(scores)} "
+                    f"combinations, {n_keep} advance."
+                )
+                if n_keep == 0:
+                    break
+            # write the result file again, now with the ranking of the last rung;
+            # everything is resumed from the journal
+            self.run(experiment, resume=True, **run_kwargs)
+        finally:
+            self.grid.constraints.remove(constraint)
+            del self.rungs
+        return rungs
+
+    @staticmethod
+    def _group(keys: List[str], combination: dict) -> tuple:
+        """
+        The group of a combination in run_adaptive and run_halving: its values
+        of keys cast to str, as RunAggregator groups them.
+        """
+        return tuple(str(combination[k]) for k in keys)
+
+    @staticmethod
+    def _observer(metric: str, aggregator, user_callback: Union[None, Callable]) -> Callable:
+        """
+        A callback for run that passes each result on to user_callback and
+        adds metric of each successful result to aggregator. metric is read
+        from result['result'] if there is one, otherwise from the result.
+        """
+
+        def observe(i: int, config: dict, result):
+            if user_callback is not None:
+                user_callback(i, config, result)
+            if isinstance(result, Exception):
+                return
+            metrics = result.get("result", result) if isinstance(result, dict) else {}
+            if metric in metrics:
+                aggregator.add({**config, metric: metrics[metric]})
+
+        return observe
+
+    def _combination(self, keys: List[str], group: tuple) -> dict:
+        """
+        The range values of a group of run_adaptive or run_halving, which
+        groups combinations by their values cast to str.
+        """
+        return {
+            k: next(v for v in self.ranges[k] if str(v) == value)
+            for k, value in zip(keys, group)
+        }
+
     @staticmethod
     def load_result(path_to_result: str):
         """
         Loads a ruska result and returns a tuple result_dict, config_dict.
+        Prefer load_table for large measurements.
         """
         path = Path(path_to_result)
         config_flag = False
         result_flag = False
 
-        result = ""
-        result_config = ""
+        result = []
+        result_config = []
 
         with open(path, "rt") as f:
             for line in f:
@@ -166,9 +604,19 @@ class Ruska:
                     result_flag = False
                 else:
                     if config_flag:
-                        result_config = result_config + line
+                        result_config.append(line)
                     elif result_flag:
-                        result = result + line
-        result_dict = eval(result)  # this is where PosixPath is used
-        result_config_dict = eval(result_config)
+                        result.append(line)
+        names = {**globals(), **_result_file_names}
+        result_dict = eval("".join(result), names)
+        result_config_dict = eval("".join(result_config), names)
         return result_dict, result_config_dict
+
+    @staticmethod
+    def load_table(path_to_table: str) -> ResultTable:
+        """
+        Opens the sqlite result file that Ruska.run writes next to the .txt
+        file. Unlike load_result, this neither parses the whole file nor
+        evaluates it, see ResultTable.
+        """
+        return ResultTable(path_to_table)
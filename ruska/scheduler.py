@@ -0,0 +1,111 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+
+def _value_key(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class RuntimeHistory:
+    """
+    Durations of past measurements, stored as JSON lines at path. Several
+    measurements may share the same history, so that a new grid can be
+    scheduled using what earlier grids have taught us about the datasets
+    and parameters involved.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def record(self, config: dict, seconds: float) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            record = {"config": config, "seconds": seconds}
+            print(json.dumps(record, sort_keys=True, default=str), file=f)
+
+    def load(self) -> List[dict]:
+        records = []
+        if not self.path.exists():
+            return records
+        with open(self.path, "rt") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:  # cut off by a crash
+                    continue
+        return records
+
+    def cost_model(self, keys: List[str]) -> "CostModel":
+        return CostModel(self.load(), keys)
+
+    def longest_first(
+        self, tasks: List[Tuple[int, dict]], keys: List[str]
+    ) -> List[Tuple[int, dict]]:
+        """
+        Sort tasks by their predicted duration, longest first. Tasks that
+        cannot be predicted keep their order at the front of the list.
+        """
+        model = self.cost_model(keys)
+        if model.n_records == 0:
+            logger = logging.getLogger(__name__)
+            logger.info(f"No runtimes recorded at {self.path}, keeping grid order.")
+            return list(tasks)
+
+        def expected_seconds(task: Tuple[int, dict]) -> float:
+            prediction = model.predict(task[1])
+            return float("inf") if prediction is None else prediction
+
+        return sorted(tasks, key=expected_seconds, reverse=True)
+
+
+class CostModel:
+    """
+    Predicts the duration of a configuration from past durations by matching
+    the values of keys, e.g. 'dataset' and 'error_fraction'.
+
+    If configurations with the same values for all keys have been measured
+    before, the prediction is the mean of their durations. Otherwise, each
+    key's value contributes the factor by which its mean duration differs
+    from the overall mean duration.
+    """
+
+    def __init__(self, records: List[dict], keys: List[str]):
+        self.keys = keys
+        self.n_records = 0
+        self.total = 0.0
+        self._exact: Dict[tuple, List[float]] = {}
+        self._by_value: Dict[Tuple[str, str], List[float]] = {}
+        for record in records:
+            config, seconds = record["config"], record["seconds"]
+            if not all(k in config for k in keys):
+                continue
+            self.n_records += 1
+            self.total += seconds
+            values = tuple(_value_key(config[k]) for k in keys)
+            self._add(self._exact, values, seconds)
+            for k, v in zip(keys, values):
+                self._add(self._by_value, (k, v), seconds)
+
+    @staticmethod
+    def _add(sums: dict, key, seconds: float) -> None:
+        s = sums.setdefault(key, [0.0, 0])
+        s[0] += seconds
+        s[1] += 1
+
+    def predict(self, config: dict) -> Union[None, float]:
+        if self.n_records == 0:
+            return None
+        values = tuple(_value_key(config.get(k)) for k in self.keys)
+        if values in self._exact:
+            seconds, n = self._exact[values]
+            return seconds / n
+
+        mean = self.total / self.n_records
+        prediction = mean
+        for k, v in zip(self.keys, values):
+            if (k, v) in self._by_value:
+                seconds, n = self._by_value[(k, v)]
+                prediction *= (seconds / n) / mean if mean > 0 else 1.0
+        return prediction
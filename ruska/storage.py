@@ -0,0 +1,218 @@
+import os
+import json
+import numbers
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Union
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _is_scalar(value) -> bool:
+    return value is None or isinstance(value, (str, numbers.Real))
+
+
+def _to_sql(value):
+    # numpy scalars like np.int64 are no Python ints, sqlite cannot bind them.
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _json_default(value):
+    # numpy scalars and arrays both know how to become plain Python objects.
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def _to_json(value) -> str:
+    """
+    Encode value as JSON, or its repr as a JSON string if it cannot be
+    encoded, e.g. a dict with tuple keys.
+    """
+    try:
+        return json.dumps(value, default=_json_default)
+    except (TypeError, ValueError):
+        return json.dumps(repr(value))
+
+
+def _sql_type(values: list) -> str:
+    values = [v for v in values if v is not None]
+    if all(isinstance(v, numbers.Integral) for v in values):
+        return "INTEGER"
+    if all(isinstance(v, numbers.Real) for v in values):
+        return "REAL"
+    return "TEXT"
+
+
+def _metrics(result) -> dict:
+    """
+    Select the scalar metrics of a result. Experiments usually return
+    {'config': ..., 'result': {...}}, in which case the metrics are the
+    scalar values of result['result'].
+    """
+    if isinstance(result, dict) and isinstance(result.get("result"), dict):
+        result = result["result"]
+    if not isinstance(result, dict):
+        return {}
+    return {k: v for k, v in result.items() if _is_scalar(v)}
+
+
+def write_result_table(
+    path: Union[str, Path],
+    ruska_config: dict,
+    configs: Iterable[dict],
+    results: list,
+    stats: Union[None, list] = None,
+) -> None:
+    """
+    Write the results of a measurement to a sqlite file. Config keys and
+    scalar metrics become typed columns named 'config.<key>' and
+    'result.<key>', the complete result is stored as a JSON blob per row,
+    or as its repr if it cannot be encoded. Exceptions are stored as their
+    repr in the column 'error'. Resources used by each measurement, if
+    given, become columns named 'stats.<key>'.
+
+    The table is written to a temporary file that replaces path once it is
+    complete, so path never holds a partial table.
+    """
+    rows = []
+    stats = [None] * len(results) if stats is None else stats
+    for config, result, result_stats in zip(configs, results, stats):
+        row = {f"config.{k}": v for k, v in config.items() if _is_scalar(v)}
+        if isinstance(result, Exception):
+            row["error"] = repr(result)
+        else:
+            row.update({f"result.{k}": v for k, v in _metrics(result).items()})
+        for k, v in (result_stats or {}).items():
+            if _is_scalar(v):
+                row[f"stats.{k}"] = v
+        rows.append(row)
+
+    columns = {}  # dicts keep the insertion order, sets don't
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    columns = list(columns)
+    types = {c: _sql_type([row.get(c) for row in rows]) for c in columns}
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    con = sqlite3.connect(tmp_path)
+    try:
+        with con:
+            con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            con.execute("INSERT INTO meta VALUES ('config', ?)", (_to_json(ruska_config),))
+            column_definitions = "".join(f", {_quote(c)} {types[c]}" for c in columns)
+            con.execute(
+                f"CREATE TABLE results (idx INTEGER PRIMARY KEY{column_definitions}, "
+                f"blob TEXT)"
+            )
+            placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+            con.executemany(
+                f"INSERT INTO results VALUES ({placeholders})",
+                (
+                    [i]
+                    + [_to_sql(row.get(c)) for c in columns]
+                    + [_to_json(result)]
+                    for i, (row, result) in enumerate(zip(rows, results))
+                ),
+            )
+    except BaseException:
+        con.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    con.close()
+    os.replace(tmp_path, path)
+
+
+class ResultTable:
+    """
+    Read a result file written by write_result_table. Nothing is read before
+    it is asked for, so selecting a few columns or rows of a large
+    measurement stays cheap.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def close(self) -> None:
+        self._con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def config(self) -> dict:
+        """The configuration of Ruska when the measurement was run."""
+        (value,) = self._con.execute(
+            "SELECT value FROM meta WHERE key = 'config'"
+        ).fetchone()
+        return json.loads(value)
+
+    @property
+    def columns(self) -> List[str]:
+        cursor = self._con.execute("SELECT * FROM results LIMIT 0")
+        return [d[0] for d in cursor.description if d[0] not in ["idx", "blob"]]
+
+    def __len__(self):
+        (n,) = self._con.execute("SELECT COUNT(*) FROM results").fetchone()
+        return n
+
+    def rows(
+        self,
+        columns: Union[None, List[str]] = None,
+        where: Union[None, Dict[str, object]] = None,
+        start: int = 0,
+        stop: Union[None, int] = None,
+    ) -> Iterator[dict]:
+        """
+        Iterate over the rows with index in [start, stop), optionally only
+        over the given columns and rows whose columns equal the values in
+        where, e.g. where={'config.dataset': 'hospital'}.
+        """
+        columns = self.columns if columns is None else columns
+        selection = ", ".join(_quote(c) for c in columns)
+        conditions = ["idx >= ?"]
+        parameters = [start]
+        if stop is not None:
+            conditions.append("idx < ?")
+            parameters.append(stop)
+        for column, value in (where or {}).items():
+            conditions.append(f"{_quote(column)} IS ?")
+            parameters.append(_to_sql(value))
+        cursor = self._con.execute(
+            f"SELECT {selection} FROM results WHERE {' AND '.join(conditions)} "
+            f"ORDER BY idx",
+            parameters,
+        )
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+    def column(self, name: str, start: int = 0, stop: Union[None, int] = None) -> list:
+        return [row[name] for row in self.rows([name], start=start, stop=stop)]
+
+    def result(self, index: int):
+        """The complete result of the configuration at index, decoded from JSON."""
+        row = self._con.execute(
+            "SELECT blob FROM results WHERE idx = ?", (index,)
+        ).fetchone()
+        if row is None:
+            raise IndexError(f"No result at index {index}.")
+        return json.loads(row[0])
+
+    def results(self, start: int = 0, stop: Union[None, int] = None) -> Iterator:
+        parameters = [start] if stop is None else [start, stop]
+        condition = "idx >= ?" if stop is None else "idx >= ? AND idx < ?"
+        cursor = self._con.execute(
+            f"SELECT blob FROM results WHERE {condition} ORDER BY idx", parameters
+        )
+        for (blob,) in cursor:
+            yield json.loads(blob)
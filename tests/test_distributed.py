@@ -0,0 +1,131 @@
+import os
+import time
+import socket
+import threading
+from pathlib import Path
+from unittest import mock
+from multiprocessing.connection import Client
+
+import pandas as pd
+
+from ruska import Ruska, get_dataset
+from ruska.distributed import Coordinator, main, work
+
+AUTHKEY = b"test"
+HOSPITAL = str(Path(__file__).parents[1] / "sample_data" / "hospital_1k_clean.csv")
+
+
+def experiment(i: int, config: dict):
+    return {"config": config, "result": {"square": config["a"] ** 2}}
+
+
+def dataset_experiment(i: int, config: dict):
+    time.sleep(0.2)  # long enough for both worker processes to get tasks
+    n_rows = len(get_dataset("hospital"))
+    return {"config": config, "result": {"n_rows": n_rows, "pid": os.getpid()}}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_workers(address, n: int = 2):
+    threads = [
+        threading.Thread(target=work, args=(experiment, address, AUTHKEY), daemon=True)
+        for _ in range(n)
+    ]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def test_workers_measure_every_task_once():
+    tasks = [(i, {"a": i}) for i in range(20)]
+    coordinator = Coordinator(tasks, ("localhost", 0), AUTHKEY)
+    threads = start_workers(coordinator.address)
+
+    results = list(coordinator.results_as_completed())
+
+    assert sorted(i for i, _, _ in results) == list(range(20))
+    for i, result, stats in results:
+        assert result["result"]["square"] == i**2
+        assert stats["wall_time"] >= 0
+    for t in threads:
+        t.join(timeout=10)
+        assert not t.is_alive()
+
+
+def test_expired_lease_is_measured_by_another_worker():
+    tasks = [(i, {"a": i}) for i in range(3)]
+    coordinator = Coordinator(tasks, ("localhost", 0), AUTHKEY, lease_timeout=1.0)
+    measured = coordinator.results_as_completed()
+    threading.Thread(target=coordinator._accept, daemon=True).start()
+
+    # a worker that leases a configuration and dies without a heartbeat
+    connection = Client(coordinator.address, authkey=AUTHKEY)
+    connection.send(("lease", "dead worker"))
+    _, _, leased, _, _ = connection.recv()
+    connection.close()
+
+    start_workers(coordinator.address, n=1)
+    results = {i: result for i, result, _ in measured}
+
+    assert sorted(results) == [0, 1, 2]
+    assert results[leased]["result"]["square"] == leased**2
+
+
+def test_run_with_coordinator(tmp_path):
+    port = free_port()
+    rsk = Ruska(
+        name="distributed",
+        description="",
+        commit="",
+        config={"a": 0, "run": 0},
+        ranges={"a": [1, 2, 3]},
+        runs=2,
+        save_path=str(tmp_path),
+    )
+    start_workers(("localhost", port))
+
+    rsk.run(experiment, coordinator=("localhost", port), authkey=AUTHKEY)
+
+    results = Ruska.load_result(str(tmp_path / "distributed.txt"))[0]
+    assert [r["result"]["square"] for r in results] == [1, 1, 4, 4, 9, 9]
+
+
+def test_worker_processes_from_the_command_line(tmp_path, monkeypatch):
+    monkeypatch.setenv("RUSKA_AUTHKEY", AUTHKEY.decode())
+    port = free_port()
+    rsk = Ruska(
+        name="processes",
+        description="",
+        commit="",
+        config={"a": 0, "run": 0},
+        ranges={"a": list(range(8))},
+        runs=1,
+        save_path=str(tmp_path),
+        datasets={"hospital": HOSPITAL},
+    )
+    exit_codes = []
+    cli = threading.Thread(
+        target=lambda: exit_codes.append(
+            main([f"localhost:{port}", "test_distributed:dataset_experiment", "--processes", "2"])
+        ),
+        daemon=True,
+    )
+    cli.start()
+
+    # the coordinator doesn't measure, so it doesn't need the datasets
+    with mock.patch("ruska.ruska.load_datasets") as load_datasets:
+        rsk.run(dataset_experiment, coordinator=("localhost", port))
+    load_datasets.assert_not_called()
+    cli.join(timeout=30)
+    assert exit_codes == [0]
+
+    results = Ruska.load_result(str(tmp_path / "processes.txt"))[0]
+    n_rows = len(pd.read_csv(HOSPITAL))
+    assert [r["result"]["n_rows"] for r in results] == [n_rows] * 8
+    pids = {r["result"]["pid"] for r in results}
+    assert len(pids) == 2 and os.getpid() not in pids
@@ -0,0 +1,93 @@
+import os
+import time
+import signal
+import collections
+
+from ruska.executor import (
+    ExperimentTimeout,
+    MemoryLimitExceeded,
+    WorkerLost,
+    _rss,
+    run_parallel,
+)
+
+
+class DiesWhenPickled:
+    def __reduce__(self):
+        os._exit(1)
+
+
+def experiment(i: int, config: dict):
+    action = config.get("action")
+    if action == "exit":
+        os._exit(1)
+    if action == "unpicklable death":
+        return DiesWhenPickled()
+    if action == "sleep":
+        time.sleep(30)
+    if action == "ignore alarms":
+        # keeps the worker's own watchdog from firing
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+        time.sleep(30)
+    if action == "allocate":
+        data = bytearray(config["bytes"])
+        data[::4096] = b"x" * len(data[::4096])  # touch every page
+        time.sleep(5)
+    return i
+
+
+def measure(configs, **kwargs) -> dict:
+    kwargs.setdefault("workers", 2)
+    results = {}
+    for i, result, stats in run_parallel(experiment, enumerate(configs), **kwargs):
+        assert i not in results
+        results[i] = (result, stats)
+    assert sorted(results) == list(range(len(configs)))
+    return results
+
+
+def test_a_worker_that_dies_is_recorded_as_lost():
+    configs = [{}, {"action": "exit"}, {}, {}]
+    results = measure(configs, chunksize=2)
+    assert isinstance(results[1][0], WorkerLost)
+    assert results[1][1] is None
+    # the rest of the dead worker's chunk is measured again
+    assert [results[i][0] for i in [0, 2, 3]] == [0, 2, 3]
+
+
+def test_a_worker_that_dies_while_delivering_does_not_hang():
+    configs = [{}, {"action": "unpicklable death"}, {}, {}]
+    start = time.monotonic()
+    results = measure(configs, chunksize=2)
+    assert time.monotonic() - start < 30
+    # both configurations of the chunk were measured, but their results died
+    assert isinstance(results[0][0], WorkerLost)
+    assert isinstance(results[1][0], WorkerLost)
+    assert [results[i][0] for i in [2, 3]] == [2, 3]
+
+
+def test_timeout_is_enforced_by_the_worker():
+    results = measure([{"action": "sleep"}, {}], timeout=1)
+    assert isinstance(results[0][0], ExperimentTimeout)
+    assert results[1][0] == 1
+
+
+def test_timeout_is_enforced_by_the_parent_when_the_worker_does_not():
+    results = measure([{"action": "ignore alarms"}, {}], timeout=0.5)
+    assert isinstance(results[0][0], ExperimentTimeout)
+    assert results[0][1] is None  # the worker was killed
+    assert results[1][0] == 1
+
+
+def test_memory_limit_is_enforced():
+    max_rss = _rss() + 100 * 2**20
+    results = measure([{"action": "allocate", "bytes": 300 * 2**20}, {}], max_rss=max_rss)
+    assert isinstance(results[0][0], MemoryLimitExceeded)
+    assert results[1][0] == 1
+
+
+def test_maxtasksperchild_counts_configurations():
+    for chunksize in [1, 2]:
+        results = measure([{}] * 8, workers=1, chunksize=chunksize, maxtasksperchild=2)
+        per_worker = collections.Counter(stats["worker"] for _, stats in results.values())
+        assert sorted(per_worker.values()) == [2, 2, 2, 2]
@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+
+from import_time import HEAVY_MODULES, STATEMENTS, measure  # noqa: E402
+
+# The budget of benchmarks/import_time.py, in seconds per statement.
+BUDGET = 0.1
+
+
+@pytest.mark.parametrize("statement", STATEMENTS)
+def test_import_is_cheap(statement):
+    m = measure(statement, repeat=3)
+    assert m["heavy_modules"] == [], f"{statement!r} loads {m['heavy_modules']} of {HEAVY_MODULES}"
+    assert m["seconds"] <= BUDGET, f"{statement!r} takes {m['seconds'] * 1000:.1f} ms"
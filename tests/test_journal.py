@@ -0,0 +1,98 @@
+import os
+import pickle
+
+import pytest
+
+from ruska import Ruska
+from ruska.journal import Journal
+
+
+def record_config(config: dict):
+    with open(os.path.join(config["calls"], f"{config['a']}_{config['run']}"), "a") as f:
+        f.write("x")
+
+
+def experiment(i: int, config: dict):
+    record_config(config)
+    if config["a"] == 2 and not os.path.exists(os.path.join(config["calls"], "fixed")):
+        raise ValueError("fails until fixed")
+    return {"config": config, "result": {"square": config["a"] ** 2}}
+
+
+def calls(path) -> dict:
+    return {
+        name: len(open(os.path.join(path, name)).read())
+        for name in os.listdir(path)
+        if name != "fixed"
+    }
+
+
+def rsk_configs(rsk: Ruska):
+    return [{**rsk.config, **combination} for _, combination in rsk.grid.indexed()]
+
+
+def test_partial_record_is_cut_off_and_appending_continues(tmp_path):
+    journal = Journal(tmp_path / "journal.pkl")
+    journal.reset()
+    for i in range(3):
+        journal.append(i, {"a": i}, i**2)
+    size = os.path.getsize(journal.path)
+    with open(journal.path, "r+b") as f:
+        f.truncate(size - 5)  # the process died while writing the last record
+
+    records = journal.load()
+    assert sorted(r["index"] for r in records.values()) == [0, 1]
+
+    journal.append(2, {"a": 2}, 4)
+    journal.append(3, {"a": 3}, 9)
+    records = journal.load()
+    assert sorted(r["index"] for r in records.values()) == [0, 1, 2, 3]
+    assert records[Journal.key({"a": 3})]["result"] == 9
+
+
+def test_unpicklable_results_are_not_journaled(tmp_path):
+    journal = Journal(tmp_path / "journal.pkl")
+    journal.reset()
+    journal.append(0, {"a": 0}, lambda: None)
+    journal.append(1, {"a": 1}, 1)
+    assert [r["index"] for r in journal.load().values()] == [1]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_resume_measures_only_failed_and_missing_configurations(tmp_path, parallel):
+    calls_path = tmp_path / "calls"
+    calls_path.mkdir()
+    rsk = Ruska(
+        name="journal",
+        description="",
+        commit="",
+        config={"a": 0, "run": 0, "calls": str(calls_path)},
+        ranges={"a": [1, 2, 3]},
+        runs=2,
+        save_path=str(tmp_path),
+    )
+    rsk.run(experiment, parallel=parallel, workers=2)
+    assert calls(calls_path) == {f"{a}_{r}": 1 for a in [1, 2, 3] for r in [0, 1]}
+
+    # the measurement died while writing the last record
+    with open(rsk.journal_path, "r+b") as f:
+        f.truncate(os.path.getsize(rsk.journal_path) - 5)
+    with open(rsk.journal_path, "rb") as f:
+        journaled = []
+        while True:
+            try:
+                journaled.append(pickle.load(f)["config"])
+            except Exception:
+                break
+    lost = {f"{c['a']}_{c['run']}" for c in rsk_configs(rsk)} - {
+        f"{c['a']}_{c['run']}" for c in journaled
+    }
+    assert len(lost) == 1
+
+    (calls_path / "fixed").touch()
+    rsk.run(experiment, parallel=parallel, workers=2, resume=True)
+
+    measured_again = {name for name, n in calls(calls_path).items() if n == 2}
+    assert measured_again == {"2_0", "2_1"} | lost
+    results = Ruska.load_result(str(tmp_path / "journal.txt"))[0]
+    assert [r["result"]["square"] for r in results] == [1, 1, 4, 4, 9, 9]
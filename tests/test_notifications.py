@@ -0,0 +1,110 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from ruska.notifications import MAX_MESSAGE_LENGTH, NotificationDispatcher
+
+
+class StubTelegram(ThreadingHTTPServer):
+    """Records the requests to sendMessage and answers them after delay."""
+
+    def __init__(self, delay: float = 0.0, status: int = 200):
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        super().__init__(("localhost", 0), _Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query)))
+        time.sleep(self.server.delay)
+        self.send_response(self.server.status)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def telegram():
+    servers = []
+
+    def start(**kwargs):
+        server = StubTelegram(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_messages_are_delivered_on_close(telegram):
+    server = telegram()
+    with NotificationDispatcher("chat", "token", min_interval=0.0, base_url=server.url) as d:
+        d.send("hello")
+    assert len(server.requests) == 1
+    path, query = server.requests[0]
+    assert path == "/bottoken/sendMessage"
+    assert query == {"chat_id": ["chat"], "text": ["hello"]}
+
+
+def test_send_does_not_wait_for_a_slow_api(telegram):
+    server = telegram(delay=1.0)
+    dispatcher = NotificationDispatcher("chat", "token", min_interval=0.0, base_url=server.url)
+    start = time.monotonic()
+    for k in range(5):
+        dispatcher.send(f"message {k}")
+    assert time.monotonic() - start < 0.5
+    dispatcher.close()
+    texts = "\n".join(query["text"][0] for _, query in server.requests)
+    assert texts.split("\n") == [f"message {k}" for k in range(5)]
+
+
+def test_messages_within_min_interval_are_coalesced(telegram):
+    server = telegram()
+    with NotificationDispatcher("chat", "token", min_interval=10.0, base_url=server.url) as d:
+        d.send("first")
+        time.sleep(0.5)  # the first message is sent right away
+        d.send("second")
+        d.send("third")
+    assert [query["text"][0] for _, query in server.requests] == [
+        "first",
+        "second\nthird",
+    ]
+
+
+def test_long_messages_are_split(telegram):
+    server = telegram()
+    with NotificationDispatcher("chat", "token", min_interval=0.0, base_url=server.url) as d:
+        d.send("x" * (MAX_MESSAGE_LENGTH + 10))
+    lengths = [len(query["text"][0]) for _, query in server.requests]
+    assert lengths == [MAX_MESSAGE_LENGTH, 10]
+
+
+def test_failed_requests_are_logged_not_raised(telegram, caplog):
+    server = telegram(status=500)
+    with NotificationDispatcher("chat", "token", min_interval=0.0, base_url=server.url) as d:
+        d.send("hello")
+    assert "Could not send a notification" in caplog.text
+
+
+def test_disabled_without_credentials(telegram):
+    server = telegram()
+    with NotificationDispatcher(None, "token", base_url=server.url) as d:
+        d.send("hello")
+    assert d._thread is None
+    assert server.requests == []
@@ -0,0 +1,30 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+from matplotlib import pyplot as plt  # noqa: E402
+
+from ruska.plotter import render_figures  # noqa: E402
+
+
+def line_plot(values: list):
+    fig, ax = plt.subplots()
+    ax.plot(values)
+    return fig
+
+
+def test_rendering_in_process_keeps_open_figures(tmp_path):
+    mine = plt.figure()
+    figures = [(tmp_path / f"{k}.png", line_plot, {"values": [k, 1]}) for k in range(2)]
+
+    paths = render_figures(figures, workers=1)
+
+    assert paths == [str(tmp_path / "0.png"), str(tmp_path / "1.png")]
+    assert all((tmp_path / f"{k}.png").stat().st_size > 0 for k in range(2))
+    assert plt.get_fignums() == [mine.number]
+    plt.close(mine)
+
+
+def test_rendering_in_workers(tmp_path):
+    figures = [(tmp_path / f"{k}.png", line_plot, {"values": [k, 1]}) for k in range(3)]
+    assert render_figures(figures, workers=2) == [str(p) for p, _, _ in figures]
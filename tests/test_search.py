@@ -0,0 +1,59 @@
+from ruska import Ruska
+
+
+def noisy_experiment(i: int, config: dict):
+    # a=1 always scores 1, a=2 alternates between 0 and 2
+    score = 1 if config["a"] == 1 else 2 * (config["run"] % 2)
+    return {"config": config, "result": {"score": score}}
+
+
+def budget_experiment(i: int, config: dict):
+    if config["a"] == 2 and config["budget"] == 1:
+        raise ValueError("skipped by the observer")
+    return {"config": config, "result": {"score": config["a"] * config["budget"]}}
+
+
+def make_ruska(tmp_path, ranges: dict, runs: int) -> Ruska:
+    return Ruska(
+        name="search",
+        description="",
+        commit="",
+        config={"a": 0, "budget": 0, "run": 0},
+        ranges=ranges,
+        runs=runs,
+        save_path=str(tmp_path),
+    )
+
+
+def test_run_adaptive_measures_until_the_metric_is_pinned_down(tmp_path):
+    rsk = make_ruska(tmp_path, {"a": [1, 2]}, runs=5)
+    seen = []
+    result = rsk.run_adaptive(
+        noisy_experiment,
+        metric="score",
+        max_se=0.1,
+        min_runs=2,
+        callback=lambda i, config, result: seen.append((config["a"], config["run"])),
+    )
+
+    assert [(r["a"], r["n_runs"]) for r in result] == [(1, 2), (2, 5)]
+    assert result[0]["score_avg"] == 1.0 and result[0]["score_se"] == 0.0
+    # the user's callback sees every configuration measured in any wave
+    assert sorted(set(seen)) == [(1, 0), (1, 1)] + [(2, r) for r in range(5)]
+
+
+def test_run_halving_advances_the_best_combinations(tmp_path):
+    rsk = make_ruska(tmp_path, {"a": [1, 2, 3], "budget": [1, 2, 3]}, runs=1)
+    seen = []
+    rungs = rsk.run_halving(
+        budget_experiment,
+        metric="score",
+        budget_key="budget",
+        callback=lambda i, config, result: seen.append(isinstance(result, Exception)),
+    )
+
+    assert [r["measured"] for r in rungs] == [2, 1, 1]
+    assert [r["advanced"] for r in rungs] == [[{"a": 3}], [{"a": 3}], []]
+    assert rungs[-1]["best_score"] == 9.0
+    # failed configurations reach the user's callback, but not the ranking
+    assert True in seen
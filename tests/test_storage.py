@@ -0,0 +1,41 @@
+from unittest import mock
+
+import pytest
+
+from ruska import Ruska
+from ruska.storage import ResultTable, write_result_table
+
+
+def test_results_that_json_cannot_encode_are_stored_as_repr(tmp_path):
+    results = [{"result": {"f1": 0.5, "per_pair": {("a", "b"): 1.0}}}]
+    write_result_table(tmp_path / "t.db", {}, [{"a": 1}], results)
+    with ResultTable(tmp_path / "t.db") as table:
+        assert table.columns == ["config.a", "result.f1"]
+        assert table.result(0) == repr(results[0])
+
+
+def test_a_failed_write_keeps_the_previous_table(tmp_path):
+    path = tmp_path / "t.db"
+    write_result_table(path, {}, [{"a": 1}], [{"result": {"f1": 0.5}}])
+    with mock.patch("ruska.storage._to_json", side_effect=RuntimeError("disk full")):
+        with pytest.raises(RuntimeError):
+            write_result_table(path, {}, [{"a": 2}], [{"result": {"f1": 0.7}}])
+    with ResultTable(path) as table:
+        assert table.column("config.a") == [1]
+    assert [p.name for p in tmp_path.iterdir()] == ["t.db"]
+
+
+def test_run_finishes_when_the_table_cannot_be_written(tmp_path, caplog):
+    rsk = Ruska(
+        name="storage",
+        description="",
+        commit="",
+        config={"a": 0, "run": 0},
+        ranges={"a": [1, 2]},
+        runs=1,
+        save_path=str(tmp_path),
+    )
+    with mock.patch("ruska.ruska.write_result_table", side_effect=OSError("disk full")):
+        rsk.run(lambda i, config: {"config": config, "result": {"f1": 0.5}})
+    assert "Could not write the result table" in caplog.text
+    assert len(Ruska.load_result(str(tmp_path / "storage.txt"))[0]) == 2